@@ -0,0 +1,37 @@
+import asyncio
+import json
+
+
+# Address of the evaluation daemon (see Tools/Evaluation Daemon.py)
+DAEMON_HOST = "localhost"
+DAEMON_PORT = 6900
+
+# A request can hold many closure sets of hundreds of roads, far above asyncio's default line limit
+STREAM_LIMIT = 2**26
+
+
+async def daemon_request(request, host = DAEMON_HOST, port = DAEMON_PORT):
+    # One request per connection: a json object on one line, answered by a json object on one line
+    reader, writer = await asyncio.open_connection(host, port, limit = STREAM_LIMIT)
+    try:
+        writer.write(json.dumps(request).encode() + b"\n")
+        await writer.drain()
+        response = json.loads(await reader.readline())
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    if "error" in response:
+        raise RuntimeError("Evaluation daemon error: " + response["error"])
+    return response
+
+
+async def evaluate_many_on_daemon(closure_sets, seeds = None, host = DAEMON_HOST, port = DAEMON_PORT):
+    response = await daemon_request({"command": "evaluate_many",
+                                     "closure_sets": closure_sets,
+                                     "seeds": seeds},
+                                    host, port)
+    return response["results"]
+
+
+async def daemon_status(host = DAEMON_HOST, port = DAEMON_PORT):
+    return await daemon_request({"command": "status"}, host, port)
@@ -0,0 +1,208 @@
+import asyncio
+import random
+import time
+from asyncio import Future
+from typing import Dict, List, Tuple
+
+from gama_pool import GamaPool, NB_STEPS, RUN_METRICS
+from daemon_client import DAEMON_HOST, DAEMON_PORT, daemon_status, evaluate_many_on_daemon
+from job_queue import FAILED, JOB_QUEUE_FILE, JOB_TIMEOUT, JobQueue
+
+
+class Evaluator:
+    '''
+    Evaluates closure sets (lists of closed road ids) and returns the metrics of each run
+    (a dict with at least "max_aqi"). All the optimizers go through this interface, the
+    backend (GAMA server, server pool, daemon, cache, surrogate, synthetic) is swappable.
+    '''
+    async def start(self):
+        pass
+
+    async def evaluate_many(self, closure_sets: List[List[int]], seeds: List[float] = None) -> List[Dict[str, float]]:
+        raise NotImplementedError
+
+    async def evaluate(self, closed_roads: List[int], seed: float = 0.0) -> Dict[str, float]:
+        return (await self.evaluate_many([closed_roads], [seed]))[0]
+
+    async def close(self):
+        pass
+
+
+class GamaEvaluator(Evaluator):
+    '''
+    Runs the simulations on experiments loaded on one or several gama-servers
+    '''
+    def __init__(self, servers: List[Tuple[str, int, int]], nb_steps = NB_STEPS):
+        # servers: (url, port, number of experiments to load on that server)
+        self.pool = GamaPool(servers, nb_steps)
+
+    async def start(self):
+        await self.pool.start()
+
+    async def evaluate_many(self, closure_sets, seeds = None):
+        return await self.pool.evaluate_many(closure_sets, seeds)
+
+    async def close(self):
+        await self.pool.close()
+
+
+class DaemonEvaluator(Evaluator):
+    '''
+    Sends the simulations to the evaluation daemon (Tools/Evaluation Daemon.py) and its warm experiments
+    '''
+    def __init__(self, host = DAEMON_HOST, port = DAEMON_PORT, nb_steps = NB_STEPS):
+        self.host = host
+        self.port = port
+        self.nb_steps = nb_steps
+
+    async def start(self):
+        status = await daemon_status(self.host, self.port)
+        if status["nb_steps"] != self.nb_steps:
+            raise ValueError("The daemon runs {} steps per simulation, {} expected".format(status["nb_steps"], self.nb_steps))
+
+    async def evaluate_many(self, closure_sets, seeds = None):
+        return await evaluate_many_on_daemon(closure_sets, seeds, self.host, self.port)
+
+
+class QueueEvaluator(Evaluator):
+    '''
+    Puts the simulations in the job queue (Common/job_queue.py) and waits for the evaluation
+    workers (Tools/Evaluation Worker.py), running on any number of nodes, to write their results.
+    A batch not finished after timeout seconds is given up.
+    '''
+    def __init__(self, file = JOB_QUEUE_FILE, nb_steps = NB_STEPS, poll_interval = 1.0, timeout = JOB_TIMEOUT):
+        self.file = file
+        self.nb_steps = nb_steps
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.queue: JobQueue = None
+
+    async def start(self):
+        self.queue = JobQueue(self.file)
+
+    async def evaluate_many(self, closure_sets, seeds = None):
+        seeds = seeds if seeds is not None else [0.0] * len(closure_sets)
+        ids = self.queue.enqueue(closure_sets, seeds, self.nb_steps)
+        results = {}
+        deadline = time.time() + self.timeout
+        while len(results) < len(ids):
+            if time.time() > deadline:
+                unfinished = [id for id in ids if id not in results]
+                self.queue.cancel(unfinished, "no result after {} seconds".format(self.timeout))
+                raise TimeoutError("{} jobs without result after {} seconds".format(len(unfinished), self.timeout))
+            await asyncio.sleep(self.poll_interval)
+            results.update(self.queue.results([id for id in ids if id not in results]))
+        for id in ids:
+            status, metrics, error = results[id]
+            if status == FAILED:
+                raise RuntimeError("Job {} failed: {}".format(id, error))
+        return [results[id][1] for id in ids]
+
+    async def close(self):
+        self.queue.close()
+
+
+class CachedEvaluator(Evaluator):
+    '''
+    Remembers the metrics of every (closure set, seed) already evaluated by the wrapped
+    evaluator, and evaluates only once the same candidate requested several times at once
+    '''
+    def __init__(self, evaluator: Evaluator):
+        self.evaluator = evaluator
+        self.cache: Dict[Tuple[Tuple[int, ...], float], Dict[str, float]] = {}
+        self.pending: Dict[Tuple[Tuple[int, ...], float], Future] = {}
+        self.nb_hits = 0
+
+    @staticmethod
+    def key(closed_roads, seed):
+        return tuple(sorted(set(closed_roads))), seed
+
+    async def start(self):
+        await self.evaluator.start()
+
+    async def evaluate_many(self, closure_sets, seeds = None):
+        seeds = seeds if seeds is not None else [0.0] * len(closure_sets)
+        keys = [self.key(closed_roads, seed) for closed_roads, seed in zip(closure_sets, seeds)]
+
+        # Candidates neither known nor being evaluated by another call
+        to_evaluate = []
+        for key in keys:
+            if key in self.cache or key in self.pending:
+                self.nb_hits += 1
+            else:
+                self.pending[key] = asyncio.get_running_loop().create_future()
+                to_evaluate.append(key)
+
+        if to_evaluate:
+            try:
+                results = await self.evaluator.evaluate_many([list(key[0]) for key in to_evaluate],
+                                                             [key[1] for key in to_evaluate])
+            except Exception as e:
+                for key in to_evaluate:
+                    self.pending.pop(key).set_exception(e)
+                raise
+            for key, metrics in zip(to_evaluate, results):
+                self.cache[key] = metrics
+                self.pending.pop(key).set_result(metrics)
+
+        return [self.cache[key] if key in self.cache else await asyncio.shield(self.pending[key]) for key in keys]
+
+    async def close(self):
+        await self.evaluator.close()
+
+
+class SurrogateEvaluator(Evaluator):
+    '''
+    Predicts the max AQI with a model fitted on previous simulations instead of running them.
+    The model only needs a predict(closure_sets) method returning one max AQI per closure set.
+    '''
+    def __init__(self, model):
+        self.model = model
+
+    async def evaluate_many(self, closure_sets, seeds = None):
+        return [{"max_aqi": max_aqi} for max_aqi in self.model.predict(closure_sets)]
+
+
+class SyntheticEvaluator(Evaluator):
+    '''
+    Cheap deterministic stand-in for the simulator, to test and tune the optimizers without GAMA:
+    each road has a fixed effect on the AQI, closing many roads pushes the traffic on the others,
+    and the seed adds a noise shared by all the candidates simulated with it.
+    '''
+    def __init__(self, nb_roads = 643, base_aqi = 25.0, noise = 0.5, random_seed = 0):
+        rng = random.Random(random_seed)
+        self.road_effects = [rng.gauss(0.0, 0.1) for _ in range(nb_roads)]
+        self.base_aqi = base_aqi
+        self.noise = noise
+
+    async def evaluate_many(self, closure_sets, seeds = None):
+        seeds = seeds if seeds is not None else [0.0] * len(closure_sets)
+        results = []
+        for closed_roads, seed in zip(closure_sets, seeds):
+            closed_roads = set(closed_roads)
+            max_aqi = self.base_aqi + sum(self.road_effects[road] for road in closed_roads) \
+                      + 0.0001 * len(closed_roads) ** 2 \
+                      + random.Random(seed).gauss(0.0, self.noise)
+            metrics = dict.fromkeys(RUN_METRICS, 0.0)
+            metrics.update({"max_aqi": max_aqi, "mean_aqi": max_aqi / 3, "max_aqi_co": max_aqi})
+            results.append(metrics)
+        return results
+
+
+def create_evaluator(backend, servers = None, nb_steps = NB_STEPS, cache = True) -> Evaluator:
+    '''
+    backend: "gama" (experiments on the given servers: a single server or a pool),
+    "daemon" (the evaluation daemon), "queue" (the job queue and its workers)
+    or "synthetic" (no simulation at all)
+    '''
+    if backend == "gama":
+        evaluator = GamaEvaluator(servers, nb_steps)
+    elif backend == "daemon":
+        evaluator = DaemonEvaluator(nb_steps = nb_steps)
+    elif backend == "queue":
+        evaluator = QueueEvaluator(nb_steps = nb_steps)
+    elif backend == "synthetic":
+        evaluator = SyntheticEvaluator()
+    else:
+        raise ValueError("Unknown evaluation backend: " + str(backend))
+    return CachedEvaluator(evaluator) if cache else evaluator
@@ -0,0 +1,70 @@
+import json
+import queue
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+
+# Event streams of the explorations (one file per run), rendered by Tools/Render Exploration.py
+EXPLORATION_DIR = Path(__file__).parents[1] / "Recursive Algorithms" / "exploration"
+
+
+def new_exploration_file() -> Path:
+    return EXPLORATION_DIR / (datetime.now().strftime("%Y-%m-%d %Hh%M %Ssec") + ".jsonl")
+
+
+def last_exploration_file() -> Path:
+    files = sorted(EXPLORATION_DIR.glob("*.jsonl"), key = lambda file: file.stat().st_mtime)
+    return files[-1] if files else None
+
+
+class ExplorationLog:
+    '''
+    Append-only stream of the nodes of an exploration, one JSON object per line:
+        {"event": "node", "id", "parent", "closed_roads", "max_aqi", "time"}: a simulated node
+        {"event": "current", "id", "time"}: the node the exploration goes on from
+    The events are queued and written by a background thread, so logging never waits for the disk
+    '''
+    def __init__(self, file = None):
+        self.file = Path(file) if file is not None else new_exploration_file()
+        self.file.parent.mkdir(parents = True, exist_ok = True)
+        self.events = queue.Queue()
+        self.writer = threading.Thread(target = self.write_events, daemon = True)
+        self.writer.start()
+
+    def node(self, id: int, parent: int, closed_roads: List[int], max_aqi: float):
+        self.events.put({"event": "node", "id": id, "parent": parent, "closed_roads": list(closed_roads),
+                         "max_aqi": max_aqi, "time": time.time()})
+
+    def current(self, id: int):
+        self.events.put({"event": "current", "id": id, "time": time.time()})
+
+    def write_events(self):
+        with open(self.file, "a") as f:
+            while True:
+                event = self.events.get()
+                if event is None:
+                    return
+                f.write(json.dumps(event) + "\n")
+                # Flushed when the writer catches up, so that a render shows the progress so far
+                if self.events.empty():
+                    f.flush()
+
+    def close(self):
+        # Write the pending events and stop the writer
+        self.events.put(None)
+        self.writer.join()
+
+
+def read_exploration(file) -> List[dict]:
+    # Events of an exploration, the last line is skipped if it is still being written
+    events = []
+    with open(file) as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+    return events
@@ -0,0 +1,389 @@
+import asyncio
+import json
+import statistics
+import time
+import uuid
+from asyncio import Future
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from gama_client.base_client import GamaBaseClient
+from gama_client.command_types import CommandTypes
+from gama_client.message_types import MessageTypes
+
+
+GAML_FILE_PATH_ON_SERVER = str(Path(__file__).parents[1] / "Hoan Kiem Air Model" / "models" / "HKAM.gaml" ).replace('\\','/')
+EXPERIMENT_NAME = "optimize"
+
+# 1 steps = 15 seconds
+# 4 steps = 1 minute
+# 240 steps = 1 hr
+# 5760 steps = 1 day
+# 11520 steps = 1 weekend
+# 40320 steps = 1 week
+# n + 2 steps (2 blank steps for initialization prob)
+NB_STEPS = 11520 + 2
+
+# Names of the metrics returned by run_metrics() in HKAM.gaml, in the same order
+RUN_METRICS = ["max_aqi", "mean_aqi", "max_aqi_co", "max_aqi_nox", "max_aqi_so2", "max_aqi_pm",
+               "min_aqi", "time_vehicles_move", "nb_recompute_path"]
+
+# Memory used by a gama-server (bytes) and the most it can use, from the platform agent. Its
+# variables are the ones of the Java runtime: free_memory is the free part of the heap allocated
+# so far (total_memory), which can grow up to max_memory (-Xmx).
+MEMORY_EXPRESSION = r"gama.total_memory - gama.free_memory"
+MAX_MEMORY_EXPRESSION = r"gama.max_memory"
+
+# An experiment reloaded many times slows down and keeps memory on the server, so it is stopped
+# and replaced with a freshly loaded one when one of these thresholds is crossed (None: never):
+#   RECYCLE_AFTER_RELOADS: number of simulations run since it was loaded
+#   RECYCLE_SLOWDOWN: median time of its last steps / median time of its first steps
+#   RECYCLE_MEMORY: fraction of the server memory in use, checked every MEMORY_CHECK_INTERVAL simulations
+RECYCLE_AFTER_RELOADS = 500
+RECYCLE_SLOWDOWN = 1.5
+RECYCLE_MEMORY = 0.85
+MEMORY_CHECK_INTERVAL = 20
+# Simulations whose step times are the reference (first ones) or the recent trend (last ones) of an experiment
+STEP_TIME_WINDOW = 10
+
+# Seconds to wait for the answer of each command before giving up on the experiment: the step
+# command waits STEP_TIMEOUT seconds per simulated step
+COMMAND_TIMEOUTS = {CommandTypes.Load.value: 600,
+                    CommandTypes.Reload.value: 300,
+                    CommandTypes.Expression.value: 120,
+                    CommandTypes.Stop.value: 120}
+STEP_TIMEOUT = 1.0
+# A simulation that failed (error, timeout, lost connection) is run again on another slot, at most MAX_ATTEMPTS times
+MAX_ATTEMPTS = 3
+
+# Hedging: a simulation running longer than the HEDGING_PERCENTILE of the previous ones is started
+# again on an idle slot, the first run to finish is kept and the other one cancelled.
+# The durations of the last HEDGING_WINDOW simulations are kept, at least HEDGING_MIN_RUNS are needed.
+HEDGING = True
+HEDGING_PERCENTILE = 0.9
+HEDGING_WINDOW = 100
+HEDGING_MIN_RUNS = 10
+
+
+class GamaCommandError(Exception):
+    '''
+    Raised when gama-server does not execute a command successfully
+    '''
+    def __init__(self, command, gama_response):
+        super().__init__("Unable to execute the {} command: {}".format(command, gama_response))
+        self.gama_response = gama_response
+
+
+class GamaTimeoutError(GamaCommandError):
+    '''
+    Raised when gama-server does not answer a command in time (see COMMAND_TIMEOUTS)
+    '''
+    def __init__(self, command, timeout):
+        super().__init__(command, "no answer after {} seconds".format(timeout))
+
+
+class GamaConnection:
+    '''
+    Connection to one gama-server on which several experiments can run concurrently.
+    Each experiment has at most one command waiting for an answer, so the answers
+    are matched to their command with the command type and the experiment id.
+    '''
+    def __init__(self, server_url, server_port):
+        self.server_url = server_url
+        self.server_port = server_port
+        self.client = GamaBaseClient(server_url, server_port, self.message_handler)
+        self.futures: Dict[Tuple[str, str], Future] = {}
+
+    def __str__(self):
+        return "{}:{}".format(self.server_url, self.server_port)
+
+    async def connect(self):
+        await self.client.connect(ping_interval = None)
+
+    async def message_handler(self, message):
+        if "command" in message:
+            command = message["command"]
+            key = (command["type"], command.get("exp_id", command.get("load_id", "")))
+            future = self.futures.pop(key, None)
+            if future is not None and not future.done():
+                future.set_result(message)
+
+    async def send(self, command_type, key, coroutine, timeout = None):
+        future = asyncio.get_running_loop().create_future()
+        self.futures[(command_type.value, key)] = future
+        timeout = timeout or COMMAND_TIMEOUTS.get(command_type.value)
+        try:
+            await coroutine
+            gama_response = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise GamaTimeoutError(command_type.value, timeout)
+        finally:
+            if self.futures.get((command_type.value, key)) is future:
+                del self.futures[(command_type.value, key)]
+        if gama_response["type"] != MessageTypes.CommandExecutedSuccessfully.value:
+            raise GamaCommandError(command_type.value, gama_response)
+        return gama_response
+
+    async def load(self, parameters = None):
+        load_id = str(uuid.uuid1())
+        gama_response = await self.send(CommandTypes.Load, load_id,
+                                        self.client.load(GAML_FILE_PATH_ON_SERVER, EXPERIMENT_NAME, False, False, False, True,
+                                                         parameters, additional_data = {"load_id": load_id}))
+        return gama_response["content"]
+
+    async def reload(self, experiment_id, parameters):
+        await self.send(CommandTypes.Reload, experiment_id, self.client.reload(experiment_id, parameters))
+
+    async def step(self, experiment_id, nb_steps):
+        await self.send(CommandTypes.Step, experiment_id, self.client.step(experiment_id, nb_steps, True),
+                        timeout = STEP_TIMEOUT * nb_steps)
+
+    async def expression(self, experiment_id, expression):
+        gama_response = await self.send(CommandTypes.Expression, experiment_id, self.client.expression(experiment_id, expression))
+        return gama_response["content"]
+
+    async def stop(self, experiment_id):
+        await self.send(CommandTypes.Stop, experiment_id, self.client.stop(experiment_id))
+
+    async def close(self):
+        await self.client.close_connection()
+
+
+class GamaSlot:
+    '''
+    One experiment loaded on a gama-server, running one simulation at a time
+    '''
+    def __init__(self, connection: GamaConnection, experiment_id: str):
+        self.connection = connection
+        self.experiment_id = experiment_id
+        self.nb_evaluations = 0
+        self.nb_recycles = 0
+        self.loaded(experiment_id)
+
+    def __str__(self):
+        return "{}/{}".format(self.connection, self.experiment_id)
+
+    def loaded(self, experiment_id):
+        self.experiment_id = experiment_id
+        self.nb_reloads = 0
+        self.first_step_times = []
+        self.last_step_times = deque(maxlen = STEP_TIME_WINDOW)
+
+    def slowdown(self) -> float:
+        # Trend of the step latency since the experiment was loaded
+        if len(self.first_step_times) < STEP_TIME_WINDOW or len(self.last_step_times) < STEP_TIME_WINDOW:
+            return 1.0
+        return statistics.median(self.last_step_times) / statistics.median(self.first_step_times)
+
+    async def recycle(self):
+        # Replace the experiment with a freshly loaded one
+        try:
+            await self.connection.stop(self.experiment_id)
+        except GamaCommandError as e:
+            print(e)
+        self.loaded(await self.connection.load())
+        self.nb_recycles += 1
+
+    async def evaluate(self, closed_roads, seed = 0.0, nb_steps = NB_STEPS):
+        new_params = [{"type": "list<int>", "name": "Closed roads", "value": closed_roads},
+                      {"type": "string", "name": "Id", "value": str(uuid.uuid1())},
+                      {"type": "float", "name": "Seed", "value": seed}]
+        await self.connection.reload(self.experiment_id, new_params)
+        self.nb_reloads += 1
+        start = time.time()
+        await self.connection.step(self.experiment_id, nb_steps)
+        step_time = (time.time() - start) / nb_steps
+        if len(self.first_step_times) < STEP_TIME_WINDOW:
+            self.first_step_times.append(step_time)
+        self.last_step_times.append(step_time)
+        content = await self.connection.expression(self.experiment_id, r"run_metrics()")
+        self.nb_evaluations += 1
+        return dict(zip(RUN_METRICS, json.loads(content)))
+
+
+class GamaPool:
+    '''
+    Experiments loaded once on one or several gama-servers and shared by all the evaluations:
+    each evaluation waits for a free slot, reloads its experiment with the closed roads
+    to evaluate, runs it and returns the metrics of the run.
+    Worn out experiments are recycled (see RECYCLE_AFTER_RELOADS) before their slot is freed,
+    failed simulations are run again on another slot and stragglers are hedged (see HEDGING).
+    '''
+    def __init__(self, servers: List[Tuple[str, int, int]], nb_steps = NB_STEPS, recycle_after_reloads = RECYCLE_AFTER_RELOADS,
+                 recycle_slowdown = RECYCLE_SLOWDOWN, recycle_memory = RECYCLE_MEMORY, hedging = HEDGING):
+        # servers: (url, port, number of experiments to load on that server)
+        self.servers = servers
+        self.nb_steps = nb_steps
+        self.recycle_after_reloads = recycle_after_reloads
+        self.recycle_slowdown = recycle_slowdown
+        self.recycle_memory = recycle_memory
+        self.nb_memory_checks = 0
+        self.hedging = hedging
+        self.nb_hedges = 0
+        # Seconds per step of the last simulations
+        self.run_times = deque(maxlen = HEDGING_WINDOW)
+        # Recycling and restoring slots happen in the background, the tasks are referenced until they end
+        self.background_tasks = set()
+        self.connections: List[GamaConnection] = []
+        self.slots: List[GamaSlot] = []
+        self.free_slots: asyncio.Queue = None
+
+    async def start(self):
+        self.free_slots = asyncio.Queue()
+        for server_url, server_port, nb_experiments in self.servers:
+            connection = GamaConnection(server_url, server_port)
+            await connection.connect()
+            self.connections.append(connection)
+            print("Loading", nb_experiments, "experiments on", connection)
+            experiment_ids = await asyncio.gather(*[connection.load() for _ in range(nb_experiments)])
+            for experiment_id in experiment_ids:
+                slot = GamaSlot(connection, experiment_id)
+                self.slots.append(slot)
+                self.free_slots.put_nowait(slot)
+        print("GAMA pool ready:", len(self.slots), "slots")
+
+    async def evaluate(self, closed_roads, seed = 0.0, nb_steps = None):
+        nb_steps = nb_steps or self.nb_steps
+        started = asyncio.Event()
+        runs = [asyncio.ensure_future(self.run(closed_roads, seed, nb_steps, started))]
+        # The runs still going are cancelled however this ends, including when the caller is cancelled
+        try:
+            threshold = self.hedging_threshold(nb_steps)
+            if threshold is None:
+                return await runs[0]
+
+            # Started again on an idle slot when it takes longer than most simulations
+            waiting = asyncio.ensure_future(started.wait())
+            try:
+                await asyncio.wait([runs[0], waiting], return_when = asyncio.FIRST_COMPLETED)
+            finally:
+                waiting.cancel()
+            done, _ = await asyncio.wait(runs, timeout = threshold)
+            if done or self.free_slots.empty():
+                return await runs[0]
+            print("Hedging", closed_roads, "after", threshold, "seconds")
+            self.nb_hedges += 1
+            runs.append(asyncio.ensure_future(self.run(closed_roads, seed, nb_steps, asyncio.Event())))
+            while True:
+                done, pending = await asyncio.wait(runs, return_when = asyncio.FIRST_COMPLETED)
+                # A run that succeeded wins over one that failed at the same time
+                succeeded = [finished for finished in done if finished.exception() is None]
+                if succeeded:
+                    return succeeded[0].result()
+                if not pending:
+                    raise done.pop().exception()
+                runs = list(pending)
+        finally:
+            for run in runs:
+                run.cancel()
+
+    async def run(self, closed_roads, seed, nb_steps, started):
+        last_error = None
+        for attempt in range(MAX_ATTEMPTS):
+            slot = await self.get_slot()
+            started.set()
+            start = time.time()
+            try:
+                print("NEW_ROADS_SET =", closed_roads, "on", slot)
+                metrics = await slot.evaluate(closed_roads, seed, nb_steps)
+            except asyncio.CancelledError:
+                # A hedged duplicate finished first: the experiment is still stepping on the server
+                self.in_background(self.restore(slot))
+                raise
+            except Exception as e:
+                print("Simulation failed on", slot, "(attempt {}/{}):".format(attempt + 1, MAX_ATTEMPTS), repr(e))
+                last_error = e
+                # Run again on another slot while this one gets a new experiment
+                self.in_background(self.restore(slot))
+                continue
+            self.run_times.append((time.time() - start) / nb_steps)
+            print("RUN_METRICS =", metrics)
+            self.in_background(self.release(slot))
+            return metrics
+        raise last_error
+
+    async def get_slot(self) -> GamaSlot:
+        if not self.slots:
+            raise RuntimeError("No GAMA experiment left in the pool")
+        slot = await self.free_slots.get()
+        if slot is None:
+            # The last slot was dropped while waiting: the sentinel is passed on to the next waiting run
+            self.free_slots.put_nowait(None)
+            raise RuntimeError("No GAMA experiment left in the pool")
+        return slot
+
+    def in_background(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    async def release(self, slot):
+        # Free the slot, with a new experiment if it is worn out
+        try:
+            reason = await self.recycling_reason(slot)
+            if reason is not None:
+                print("Recycling", slot, "after", slot.nb_reloads, "simulations:", reason)
+                await slot.recycle()
+        except Exception as e:
+            print("Unable to recycle", slot, repr(e))
+            await self.restore(slot)
+            return
+        self.free_slots.put_nowait(slot)
+
+    async def restore(self, slot):
+        # Load a new experiment on a slot whose experiment is in an unknown state, or drop the slot
+        try:
+            await slot.recycle()
+        except Exception as e:
+            print("Removing", slot, "from the pool:", repr(e))
+            self.slots.remove(slot)
+            if not self.slots:
+                # Wakes up the runs waiting for a slot, none will ever be freed
+                self.free_slots.put_nowait(None)
+            return
+        self.free_slots.put_nowait(slot)
+
+    def hedging_threshold(self, nb_steps):
+        if not self.hedging or len(self.run_times) < HEDGING_MIN_RUNS:
+            return None
+        run_times = sorted(self.run_times)
+        return run_times[min(len(run_times) - 1, int(HEDGING_PERCENTILE * len(run_times)))] * nb_steps
+
+    async def memory_usage(self, slot) -> float:
+        # Fraction of the memory of the server of the slot in use
+        used = float(await slot.connection.expression(slot.experiment_id, MEMORY_EXPRESSION))
+        return used / float(await slot.connection.expression(slot.experiment_id, MAX_MEMORY_EXPRESSION))
+
+    async def recycling_reason(self, slot):
+        if self.recycle_after_reloads is not None and slot.nb_reloads >= self.recycle_after_reloads:
+            return "{} reloads".format(slot.nb_reloads)
+        if self.recycle_slowdown is not None and slot.slowdown() >= self.recycle_slowdown:
+            return "steps {:.2f} times slower".format(slot.slowdown())
+        self.nb_memory_checks += 1
+        if self.recycle_memory is not None and self.nb_memory_checks % MEMORY_CHECK_INTERVAL == 0:
+            try:
+                memory = await self.memory_usage(slot)
+            except (GamaCommandError, ValueError, ZeroDivisionError) as e:
+                print("Unable to read the memory of", slot.connection, e)
+                return None
+            # An experiment that was just loaded is not the one holding the memory
+            if memory >= self.recycle_memory and slot.nb_reloads >= STEP_TIME_WINDOW:
+                return "{:.0%} of the server memory in use".format(memory)
+        return None
+
+    async def evaluate_many(self, closure_sets, seeds = None, nb_steps = None):
+        seeds = seeds if seeds is not None else [0.0] * len(closure_sets)
+        return await asyncio.gather(*[self.evaluate(closed_roads, seed, nb_steps)
+                                      for closed_roads, seed in zip(closure_sets, seeds)])
+
+    async def close(self):
+        if self.background_tasks:
+            await asyncio.wait(self.background_tasks)
+        for slot in self.slots:
+            try:
+                await slot.connection.stop(slot.experiment_id)
+            except GamaCommandError as e:
+                print(e)
+        for connection in self.connections:
+            await connection.close()
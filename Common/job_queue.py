@@ -0,0 +1,128 @@
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+
+# Queue shared by the optimizers (QueueEvaluator in evaluator.py) and the workers (Tools/Evaluation Worker.py).
+# To spread the workers over several nodes, put it on a shared file system with working file locks.
+JOB_QUEUE_FILE = Path(__file__).parents[1] / "Tools" / "jobs.sqlite"
+
+# A leased job goes back to the queue when its worker has not sent a heartbeat for LEASE_DURATION seconds
+LEASE_DURATION = 300.0
+# A job failing MAX_ATTEMPTS times, or whose lease expires MAX_ATTEMPTS times (its closure set
+# may be killing the workers), is given up, its optimizer gets the error
+MAX_ATTEMPTS = 3
+# Seconds an optimizer waits for the results of a batch before giving up its unfinished jobs
+JOB_TIMEOUT = 6 * 3600.0
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue:
+    '''
+    Durable queue of simulations in a SQLite file, without any broker: optimizers enqueue closure
+    sets, workers lease them, keep their leases alive with heartbeats and write the metrics back.
+    The jobs of a worker that stops sending heartbeats are leased again by the other workers.
+    '''
+    def __init__(self, file = JOB_QUEUE_FILE):
+        self.file = str(file)
+        self.connection = sqlite3.connect(self.file, timeout = 60, isolation_level = None)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                                       id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                       closed_roads TEXT NOT NULL,
+                                       seed REAL NOT NULL,
+                                       nb_steps INTEGER NOT NULL,
+                                       status TEXT NOT NULL,
+                                       worker TEXT,
+                                       lease_expires REAL,
+                                       attempts INTEGER NOT NULL DEFAULT 0,
+                                       result TEXT,
+                                       error TEXT,
+                                       created REAL NOT NULL,
+                                       finished REAL)""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_expires)")
+
+    def close(self):
+        self.connection.close()
+
+    def transaction(self):
+        # Write lock taken at the start, so that two workers can't lease the same job
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def enqueue(self, closure_sets, seeds, nb_steps) -> List[int]:
+        now = time.time()
+        connection = self.transaction()
+        try:
+            ids = [connection.execute("INSERT INTO jobs (closed_roads, seed, nb_steps, status, created) VALUES (?, ?, ?, ?, ?)",
+                                      (json.dumps(list(closed_roads)), seed, nb_steps, PENDING, now)).lastrowid
+                   for closed_roads, seed in zip(closure_sets, seeds)]
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return ids
+
+    def lease(self, worker, nb_jobs, lease_duration = LEASE_DURATION) -> List[Tuple[int, List[int], float, int]]:
+        # Oldest pending jobs, and jobs whose lease expired: (id, closed roads, seed, nb steps)
+        now = time.time()
+        connection = self.transaction()
+        try:
+            connection.execute("UPDATE jobs SET status = ?, error = ?, worker = NULL, finished = ? "
+                               "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                               (FAILED, "lease expired {} times".format(MAX_ATTEMPTS), now, LEASED, now, MAX_ATTEMPTS))
+            jobs = connection.execute("SELECT id, closed_roads, seed, nb_steps FROM jobs "
+                                      "WHERE status = ? OR (status = ? AND lease_expires < ?) ORDER BY id LIMIT ?",
+                                      (PENDING, LEASED, now, nb_jobs)).fetchall()
+            connection.executemany("UPDATE jobs SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                                   [(LEASED, worker, now + lease_duration, job[0]) for job in jobs])
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return [(id, json.loads(closed_roads), seed, nb_steps) for id, closed_roads, seed, nb_steps in jobs]
+
+    def heartbeat(self, worker, ids, lease_duration = LEASE_DURATION):
+        self.connection.executemany("UPDATE jobs SET lease_expires = ? WHERE id = ? AND worker = ? AND status = ?",
+                                    [(time.time() + lease_duration, id, worker, LEASED) for id in ids])
+
+    def release(self, worker, ids):
+        # Give leased jobs back without counting the attempt
+        self.connection.executemany("UPDATE jobs SET status = ?, worker = NULL, attempts = attempts - 1 WHERE id = ? AND worker = ? AND status = ?",
+                                    [(PENDING, id, worker, LEASED) for id in ids])
+
+    def complete(self, id, result: Dict[str, float]):
+        # The first result of a job is kept (a job leased again after an expired lease can run twice)
+        self.connection.execute("UPDATE jobs SET status = ?, result = ?, finished = ? WHERE id = ? AND status != ?",
+                                (DONE, json.dumps(result), time.time(), id, DONE))
+
+    def fail(self, worker, id, error):
+        # Only the worker holding the lease can fail the job, not one whose lease was taken over
+        self.connection.execute("UPDATE jobs SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, error = ?, worker = NULL, "
+                                "finished = CASE WHEN attempts >= ? THEN ? END "
+                                "WHERE id = ? AND worker = ? AND status = ?",
+                                (MAX_ATTEMPTS, FAILED, PENDING, str(error), MAX_ATTEMPTS, time.time(), id, worker, LEASED))
+
+    def cancel(self, ids, error):
+        # Give up jobs nobody waits for anymore
+        self.connection.executemany("UPDATE jobs SET status = ?, error = ?, worker = NULL, finished = ? WHERE id = ? AND status IN (?, ?)",
+                                    [(FAILED, str(error), time.time(), id, PENDING, LEASED) for id in ids])
+
+    def results(self, ids) -> Dict[int, Tuple[str, Dict[str, float], str]]:
+        # (status, metrics, error) of the finished jobs among the given ones
+        finished = {}
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            for id, status, result, error in self.connection.execute(
+                    "SELECT id, status, result, error FROM jobs WHERE status IN (?, ?) AND id IN ({})".format(",".join("?" * len(chunk))),
+                    [DONE, FAILED] + list(chunk)):
+                finished[id] = (status, json.loads(result) if result is not None else None, error)
+        return finished
+
+    def status(self) -> Dict[str, int]:
+        return dict(self.connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
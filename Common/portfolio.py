@@ -0,0 +1,180 @@
+import asyncio
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from evaluator import CachedEvaluator, Evaluator
+
+
+# Number of evaluations of a member over which its improvement rate is measured
+IMPROVEMENT_WINDOW = 50
+# Share of the slots every member keeps, however little it improves
+MIN_WEIGHT = 0.1
+
+
+class BudgetExhausted(Exception):
+    '''
+    Raised to the optimizers of a portfolio once its simulation budget is spent
+    '''
+
+
+class Portfolio:
+    '''
+    Several optimizers run side by side on one evaluator (one pool of slots and one cache):
+    each optimizer evaluates through its PortfolioMember, the free slots are given to the
+    waiting member with the fewest running simulations for its weight, and the weights follow
+    how fast each member improved the max AQI over its last IMPROVEMENT_WINDOW evaluations.
+    The best closure set found by any member is shared (see portfolio_best). All the members
+    are expected to simulate with the same seed, given here.
+    '''
+    def __init__(self, evaluator: Evaluator, nb_slots, budget = None, seed = 0.0):
+        self.evaluator = evaluator
+        self.seed = seed
+        self.nb_slots = nb_slots
+        self.free_slots = nb_slots
+        self.budget = budget
+        self.nb_evaluations = 0
+        self.members: List[PortfolioMember] = []
+        self.best_closed_roads: List[int] = None
+        self.best_max_aqi = float("inf")
+
+    def member(self, name) -> "PortfolioMember":
+        member = PortfolioMember(self, name)
+        self.members.append(member)
+        return member
+
+    async def acquire(self, member):
+        if self.budget is not None and self.nb_evaluations >= self.budget:
+            raise BudgetExhausted()
+        self.nb_evaluations += 1
+        if self.free_slots > 0 and not any(m.waiting for m in self.members):
+            self.free_slots -= 1
+            member.running += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        member.waiting.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future in member.waiting:
+                member.waiting.remove(future)
+            elif future.done() and not future.cancelled():
+                self.release(member)
+            raise
+
+    def release(self, member, simulated = True):
+        # A slot given back without simulation (its result came from the cache meanwhile) is not
+        # counted against the budget
+        if not simulated:
+            self.nb_evaluations -= 1
+        member.running -= 1
+        self.free_slots += 1
+        while self.free_slots > 0:
+            waiting = [m for m in self.members if m.waiting]
+            if not waiting:
+                return
+            chosen = min(waiting, key = lambda m: (m.running + 1) / m.weight)
+            self.free_slots -= 1
+            chosen.running += 1
+            chosen.waiting.popleft().set_result(None)
+
+    def cached(self, closed_roads, seed):
+        # Whether the evaluator answers without a new simulation: the result is in its cache or
+        # being simulated for another member
+        if not isinstance(self.evaluator, CachedEvaluator):
+            return False
+        key = CachedEvaluator.key(closed_roads, seed)
+        return key in self.evaluator.cache or key in self.evaluator.pending
+
+    def record(self, member, closed_roads, max_aqi):
+        member.record(max_aqi)
+        if max_aqi < self.best_max_aqi:
+            self.best_max_aqi = max_aqi
+            self.best_closed_roads = sorted(closed_roads)
+            print("Portfolio best found by", member.name, ":", max_aqi)
+        self.rebalance()
+
+    def rebalance(self):
+        # Members still in their first IMPROVEMENT_WINDOW evaluations keep a full weight
+        rates = [member.improvement_rate() for member in self.members]
+        best_rate = max([rate for rate in rates if rate is not None], default = 0.0)
+        for member, rate in zip(self.members, rates):
+            if rate is None:
+                member.weight = 1.0 + MIN_WEIGHT
+            else:
+                member.weight = MIN_WEIGHT + (rate / best_rate if best_rate > 0 else 1.0)
+
+    def summary(self) -> Dict[str, Tuple[int, float, float]]:
+        # (evaluations, best max AQI, weight) of each member
+        return {member.name: (member.nb_evaluations, member.best_max_aqi, member.weight) for member in self.members}
+
+
+class PortfolioMember(Evaluator):
+    '''
+    Evaluator of one optimizer of a Portfolio
+    '''
+    def __init__(self, portfolio: Portfolio, name):
+        self.portfolio = portfolio
+        self.name = name
+        self.weight = 1.0
+        self.running = 0
+        self.waiting = deque()
+        self.nb_evaluations = 0
+        self.best_max_aqi = float("inf")
+        # Best max AQI of the member after each of its last evaluations
+        self.history = deque(maxlen = IMPROVEMENT_WINDOW + 1)
+        # Max AQI of the shared best closure sets projected on the search space of the member
+        self.projections: Dict[Tuple[int, ...], float] = {}
+
+    def record(self, max_aqi):
+        self.nb_evaluations += 1
+        self.best_max_aqi = min(self.best_max_aqi, max_aqi)
+        self.history.append(self.best_max_aqi)
+
+    def improvement_rate(self) -> Optional[float]:
+        # Decrease of its best max AQI per evaluation over the window, None before the window is full
+        if len(self.history) <= IMPROVEMENT_WINDOW:
+            return None
+        return (self.history[0] - self.history[-1]) / IMPROVEMENT_WINDOW
+
+    async def evaluate_one(self, closed_roads, seed):
+        # Only the simulations actually run take a slot and count against the budget
+        slot = False
+        if not self.portfolio.cached(closed_roads, seed):
+            await self.portfolio.acquire(self)
+            slot = True
+            if self.portfolio.cached(closed_roads, seed):
+                self.portfolio.release(self, simulated = False)
+                slot = False
+        try:
+            metrics = (await self.portfolio.evaluator.evaluate_many([closed_roads], [seed]))[0]
+        finally:
+            if slot:
+                self.portfolio.release(self)
+        self.portfolio.record(self, closed_roads, metrics["max_aqi"])
+        return metrics
+
+    async def evaluate_many(self, closure_sets, seeds = None):
+        seeds = seeds if seeds is not None else [0.0] * len(closure_sets)
+        return await asyncio.gather(*[self.evaluate_one(closed_roads, seed) for closed_roads, seed in zip(closure_sets, seeds)])
+
+
+async def portfolio_best(evaluator, space) -> Optional[Tuple[List[bool], float]]:
+    '''
+    Best closure set found by the portfolio of the evaluator, projected on the given search space
+    (the fixed roads of the space closed, its free roads as in the closure set, repaired if that
+    disconnects the network), as a vector with its max AQI. A projection that is not the shared
+    closure set itself is simulated once, with the seed of the portfolio.
+    None when the evaluator is not part of a portfolio.
+    '''
+    if not isinstance(evaluator, PortfolioMember) or evaluator.portfolio.best_closed_roads is None:
+        return None
+    closed_roads = evaluator.portfolio.best_closed_roads
+    vector = space.to_vector(closed_roads)
+    space.repair(vector)
+    projection = space.to_closed_roads(vector)
+    if projection == closed_roads:
+        return vector, evaluator.portfolio.best_max_aqi
+    key = tuple(projection)
+    if key not in evaluator.projections:
+        evaluator.projections[key] = (await evaluator.evaluate(projection, evaluator.portfolio.seed))["max_aqi"]
+    return vector, evaluator.projections[key]
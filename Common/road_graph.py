@@ -0,0 +1,179 @@
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import shapefile
+
+
+ROADS_SHAPE_FILE = Path(__file__).parents[1] / "Hoan Kiem Air Model" / "includes" / "bigger_map" / "roads.shp"
+
+# Roads that must stay open whatever the closure set (main axes of the district)
+ROAD_CANT_CLOSE =  [30, 31, 32, 33, 34, 35, 36, 37, 38, 39, 40, 41, 42, 43, 49, 97, 98, 174, 207, 208, 209, 210, 211, 212, 213, 214, 312, 313, 321, 322, 323, 324, 325, 326, 327, 328, 329, 330, 331, 332, 333, 334, 335, 336, 337, 377, 378, 379, 380, 381, 382, 383, 384, 385, 386, 387, 388, 389, 390, 409, 414, 415, 416, 417, 418,
+419, 420, 421, 431, 432, 433, 434, 435, 436, 437, 438, 439, 440, 441, 442, 445, 446, 451, 452, 453, 454, 455, 456, 457, 487, 488, 489, 519, 523, 524, 525, 526, 527, 528, 529, 531, 532, 533, 534, 535, 541, 544, 545, 546, 547, 548, 549, 586, 587, 588, 589, 590, 591, 592, 598, 599, 600, 601, 602, 616, 617, 631, 632, 633, 634, 635, 636, 641, 642]
+
+
+class RoadGraph:
+    '''
+    Road network of roads.shp as HKAM.gaml builds it with as_edge_graph: each road is an
+    edge between its first and last points, road ids are the indexes of the roads in the file.
+    Used to check closure sets locally, without running a simulation.
+    '''
+    def __init__(self, shape_file = ROADS_SHAPE_FILE, cant_close = ROAD_CANT_CLOSE):
+        vertex_ids: Dict[Tuple[float, float], int] = {}
+        self.ends: List[Tuple[int, int]] = []
+        # Street of each road: its name, or its OpenStreetMap way for the unnamed roads
+        self.streets: List[str] = []
+        for shape_record in shapefile.Reader(str(shape_file)).iterShapeRecords():
+            points = shape_record.shape.points
+            source = vertex_ids.setdefault(tuple(points[0]), len(vertex_ids))
+            target = vertex_ids.setdefault(tuple(points[-1]), len(vertex_ids))
+            self.ends.append((source, target))
+            self.streets.append(shape_record.record["name"] or "osm " + shape_record.record["osm_id"])
+        self.nb_roads = len(self.ends)
+        self.nb_vertices = len(vertex_ids)
+        self.cant_close = set(cant_close)
+
+        self.vertex_roads: List[List[int]] = [[] for _ in range(self.nb_vertices)]
+        for road, (source, target) in enumerate(self.ends):
+            self.vertex_roads[source].append(road)
+            if target != source:
+                self.vertex_roads[target].append(road)
+
+        # Connected components of the original network: roads.shp is not fully connected,
+        # a closure set is only expected to keep each of them connected
+        self.components = self.open_components([])
+
+    def adjacent_roads(self, closed_roads) -> List[int]:
+        # Same as adjacent_roads() in HKAM.gaml: the roads sharing an end with one of the given roads
+        closed_roads = set(closed_roads)
+        adjacent = []
+        for road in sorted(closed_roads):
+            for vertex in self.ends[road]:
+                adjacent += [r for r in self.vertex_roads[vertex] if r not in closed_roads and r not in adjacent]
+        return adjacent
+
+    def street_groups(self) -> List[List[int]]:
+        '''
+        Roads grouped by street: the roads of a group have the same street and are connected
+        to each other through roads of that street (a name used in two places gives two groups)
+        '''
+        parent = list(range(self.nb_roads))
+
+        def find(r):
+            while parent[r] != r:
+                parent[r] = parent[parent[r]]
+                r = parent[r]
+            return r
+
+        for road, (source, target) in enumerate(self.ends):
+            for vertex in (source, target):
+                for other in self.vertex_roads[vertex]:
+                    if self.streets[other] == self.streets[road]:
+                        parent[find(other)] = find(road)
+
+        groups: Dict[int, List[int]] = {}
+        for road in range(self.nb_roads):
+            groups.setdefault(find(road), []).append(road)
+        return sorted(groups.values())
+
+    def open_components(self, closed_roads) -> List[int]:
+        # Component of each open road (-1 for closed roads), by union-find on the vertices
+        closed_roads = set(closed_roads)
+        parent = list(range(self.nb_vertices))
+
+        def find(v):
+            while parent[v] != v:
+                parent[v] = parent[parent[v]]
+                v = parent[v]
+            return v
+
+        for road, (source, target) in enumerate(self.ends):
+            if road not in closed_roads:
+                parent[find(source)] = find(target)
+        return [-1 if road in closed_roads else find(self.ends[road][0]) for road in range(self.nb_roads)]
+
+    def is_feasible(self, closed_roads) -> bool:
+        '''
+        A closure set is feasible when it does not close a road of ROAD_CANT_CLOSE and the open
+        roads of each component of the original network are still connected to each other,
+        so that vehicles can still go from any building to any other
+        '''
+        if not self.cant_close.isdisjoint(closed_roads):
+            return False
+        components = self.open_components(closed_roads)
+        open_component: Dict[int, int] = {}
+        for road in range(self.nb_roads):
+            if components[road] != -1 and open_component.setdefault(self.components[road], components[road]) != components[road]:
+                return False
+        return True
+
+    def repair(self, closed_roads, fixed_roads = ()) -> List[int]:
+        '''
+        Make a closure set feasible by reopening as few roads as possible: the roads of
+        ROAD_CANT_CLOSE, then, while a component of the original network is split, the closed
+        roads of the shortest path linking its largest open part to another one.
+        The fixed roads (e.g. the pedestrian area) are never reopened.
+        '''
+        closed_roads = set(closed_roads) - self.cant_close
+        fixed_roads = set(fixed_roads)
+        while True:
+            components = self.open_components(closed_roads)
+            parts: Dict[int, Dict[int, int]] = {}
+            for road in range(self.nb_roads):
+                if components[road] != -1:
+                    part_sizes = parts.setdefault(self.components[road], {})
+                    part_sizes[components[road]] = part_sizes.get(components[road], 0) + 1
+            split = [part_sizes for part_sizes in parts.values() if len(part_sizes) > 1]
+            if not split:
+                return sorted(closed_roads)
+            reopened = self.reconnect(closed_roads, fixed_roads, components, max(split[0], key = split[0].get))
+            if not reopened:
+                # Only fixed roads could reconnect the network
+                return sorted(closed_roads)
+            closed_roads -= reopened
+
+    def reconnect(self, closed_roads, fixed_roads, components, main_part) -> set:
+        # Breadth-first search through the closed roads from the vertices of the main open part,
+        # until a vertex of another open part is reached
+        distances = [None] * self.nb_vertices
+        previous_road = [None] * self.nb_vertices
+        queue = deque()
+        for road in range(self.nb_roads):
+            if components[road] == main_part:
+                for vertex in self.ends[road]:
+                    distances[vertex] = 0
+                    queue.append(vertex)
+
+        while queue:
+            vertex = queue.popleft()
+            for road in self.vertex_roads[vertex]:
+                if road in fixed_roads:
+                    continue
+                if components[road] not in (-1, main_part):
+                    # Reached another open part: reopen the closed roads of the path
+                    reopened = set()
+                    while previous_road[vertex] is not None:
+                        reopened.add(previous_road[vertex])
+                        source, target = self.ends[previous_road[vertex]]
+                        vertex = source if target == vertex else target
+                    return reopened
+                if components[road] != -1:
+                    continue
+                source, target = self.ends[road]
+                neighbour = target if source == vertex else source
+                if distances[neighbour] is None or distances[neighbour] > distances[vertex] + 1:
+                    distances[neighbour] = distances[vertex] + 1
+                    previous_road[neighbour] = road
+                    queue.append(neighbour)
+        return set()
+
+
+road_graph: RoadGraph = None
+
+
+def get_road_graph() -> RoadGraph:
+    # roads.shp is read once per process
+    global road_graph
+    if road_graph is None:
+        road_graph = RoadGraph()
+    return road_graph
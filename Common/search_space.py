@@ -0,0 +1,69 @@
+import random
+from typing import List, Tuple
+
+from road_graph import ROAD_CANT_CLOSE, get_road_graph
+
+
+# Total number of roads in the simulation
+NB_ROADS = 643
+
+# Pedestrian area (Phố đi bộ Hồ Hoàn Kiếm)
+PHODIBO = [10, 11, 82, 132, 133, 158, 201, 202, 203, 271, 274, 276, 277, 279, 292, 302, 303, 304, 305, 306, 307, 308, 309, 310, 311, 344, 425, 426, 427, 428, 540, 583, 585, 640]
+
+# Pedestrian area as extended in 2023
+PHODIBO_2023 = [0, 1, 2, 3, 6, 7, 8, 10, 11, 12, 13, 23, 24, 25, 26, 27, 28, 29, 82, 132, 133, 146, 158, 195, 196, 197, 198, 201, 202, 203, 215, 216, 217, 218, 219, 220, 221, 222, 271, 274, 276, 277, 279, 302, 303, 304, 305, 306, 307, 308, 309, 310, 311, 315, 317, 318, 319, 320, 344, 346, 359, 360, 361, 362, 391, 397, 425, 426, 427, 428, 482, 483, 485, 540, 585, 640]
+
+
+def street_groups() -> List[List[int]]:
+    # Roads of the same street, closed and opened together when a SearchSpace is built with them
+    return get_road_graph().street_groups()
+
+
+class SearchSpace:
+    '''
+    Mapping between the closed roads among the NB_ROADS roads of the simulation and a compact
+    vector of booleans with one entry per free unit: the roads that are always closed (fixed_roads)
+    and the ones that can't be closed (ROAD_CANT_CLOSE) are left out of the vector.
+    A unit is a single road, or the free roads of a street when groups (e.g. street_groups()) are given.
+    '''
+    def __init__(self, fixed_roads = PHODIBO, cant_close = ROAD_CANT_CLOSE, nb_roads = NB_ROADS, groups = None):
+        self.fixed_roads = sorted(fixed_roads)
+        self.cant_close = sorted(cant_close)
+        excluded = set(fixed_roads) | set(cant_close)
+        self.free_roads = [road for road in range(nb_roads) if road not in excluded]
+        groups = groups if groups is not None else [[road] for road in range(nb_roads)]
+        self.units: List[Tuple[int, ...]] = [unit for unit in (tuple(road for road in group if road not in excluded)
+                                                               for group in groups) if unit]
+        self.index_of = {road: i for i, unit in enumerate(self.units) for road in unit}
+        self.dimension = len(self.units)
+
+    def unit_of(self, road) -> Tuple[int, ...]:
+        # Roads closed together with the given one, None if it is not free
+        return self.units[self.index_of[road]] if road in self.index_of else None
+
+    def to_closed_roads(self, vector) -> List[int]:
+        return sorted(self.fixed_roads + [road for i, closed in enumerate(vector) if closed for road in self.units[i]])
+
+    def to_vector(self, closed_roads) -> List[bool]:
+        # A unit is closed when all its roads are
+        closed_roads = set(closed_roads)
+        return [closed_roads.issuperset(unit) for unit in self.units]
+
+    def random_vector(self, proba_closed = 0.5) -> List[bool]:
+        # proba_closed: the same probability for all the units, or one per unit (see sensitivity.py)
+        if isinstance(proba_closed, list):
+            return [random.random() < proba for proba in proba_closed]
+        return [random.random() < proba_closed for _ in range(self.dimension)]
+
+    def repair(self, vector):
+        # Reopen as few units as possible to keep the network connected (see RoadGraph.repair), in place
+        road_graph = get_road_graph()
+        closed_roads = self.to_closed_roads(vector)
+        while not road_graph.is_feasible(closed_roads):
+            # A partly reopened street is reopened entirely, which can split the network again
+            vector[:] = self.to_vector(road_graph.repair(closed_roads, self.fixed_roads))
+            repaired_roads = self.to_closed_roads(vector)
+            if repaired_roads == closed_roads:
+                # Only fixed roads could reconnect the network
+                return
+            closed_roads = repaired_roads
@@ -0,0 +1,43 @@
+import json
+import math
+from pathlib import Path
+from typing import Dict, List
+
+
+# Written by Tools/Sensitivity Screening.py
+SENSITIVITY_INDEX_FILE = Path(__file__).parents[1] / "Tools" / "sensitivity_index.json"
+
+
+def load_sensitivity_index(file = SENSITIVITY_INDEX_FILE) -> Dict[int, float]:
+    '''
+    Marginal effect on the max AQI of closing each road on top of the pedestrian area,
+    empty when the screening has not been run (all the roads are then equally likely)
+    '''
+    file = Path(file)
+    if not file.exists():
+        print("No sensitivity index in", file)
+        return {}
+    with open(file) as f:
+        index = json.load(f)
+    return {int(road): effect for road, effect in index["effects"].items() if effect is not None}
+
+
+def unit_preferences(units, index: Dict[int, float]) -> List[float]:
+    '''
+    Relative preference for closing each unit (tuple of roads): exp(-effect / scale), where the effect
+    of a unit is the sum of the effects of its roads and scale their standard deviation, so that
+    the closures lowering the AQI the most are the most likely. Unknown roads have no effect.
+    '''
+    if not index:
+        return [1.0] * len(units)
+    effects = [sum(index.get(road, 0.0) for road in unit) for unit in units]
+    mean = sum(effects) / len(effects)
+    scale = math.sqrt(sum((effect - mean) ** 2 for effect in effects) / len(effects)) or 1.0
+    return [math.exp(-(effect - mean) / scale) for effect in effects]
+
+
+def closure_probabilities(units, index: Dict[int, float], mean_proba, max_proba = 0.9) -> List[float]:
+    # Probability for each unit to be closed, proportional to its preference, mean_proba on average
+    preferences = unit_preferences(units, index)
+    mean_preference = sum(preferences) / len(preferences)
+    return [min(max_proba, mean_proba * preference / mean_preference) for preference in preferences]
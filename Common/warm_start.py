@@ -0,0 +1,159 @@
+import hashlib
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from road_graph import get_road_graph
+
+
+MODELS_DIR = Path(__file__).parents[1] / "Hoan Kiem Air Model" / "models"
+
+# Logs of previous PSO runs: each "process initial fitness" block lists the simulated closure
+# sets (NEW_ROADS_SET = ...) followed by their AQIs (AQI = ...) in the same order. The PSOs now
+# log each AQI with its closure set (AQI = ... CLOSED_ROADS = ...), after the marker of the
+# model they simulate (see model_marker()).
+PSO_RESULTS_FILES = sorted(MODELS_DIR.glob("pso results - *.txt"))
+# Max AQI every 20 cycles of previous simulations, the last record of each closure set is kept
+SAVED_DATA_FILE = MODELS_DIR / "HKAM Data" / "SavedData.txt"
+
+# The max AQIs logged after the marker of the current model and simulation length are known:
+# the warm-start solutions keep them and are not simulated again. The others come from another
+# version of the model or length (or from logs without a marker): they only rank the closure
+# sets of their own log, and the solutions picked from them are simulated again.
+# With RESIMULATE, every warm-start solution is simulated again, e.g. to compare them with the
+# other candidates under the seed of the run.
+RESIMULATE = False
+
+NEW_ROADS_SET = re.compile(r"^NEW_ROADS_SET = .*'value': (\[[\d, ]*\])")
+AQI = re.compile(r"^AQI = ([\d.eE+-]+)")
+CLOSED_ROADS = re.compile(r"CLOSED_ROADS = (\[[\d, ]*\])")
+MODEL_MARKER = re.compile(r"^MODEL_VERSION = \w+ NB_STEPS = \d+")
+SAVED_DATA = re.compile(r"closed roads: (\[[\d,]*\]); cycle: (\d+); max_aqi: ([\d.eE+-]+)")
+
+
+def model_version() -> str:
+    # Digest of the GAML files: any change of the model gives another version
+    digest = hashlib.sha1()
+    for file in sorted(MODELS_DIR.rglob("*.gaml")):
+        digest.update(file.relative_to(MODELS_DIR).as_posix().encode())
+        digest.update(file.read_bytes())
+    return digest.hexdigest()[:12]
+
+
+def model_marker(nb_steps) -> str:
+    '''
+    Line logged by the optimizers before their results: the max AQIs that follow it are only
+    known for this version of the model and simulation length
+    '''
+    return "MODEL_VERSION = {} NB_STEPS = {}".format(model_version(), nb_steps)
+
+
+def parse_roads(text) -> Tuple[int, ...]:
+    return tuple(sorted(int(road) for road in text.strip("[]").split(",") if road.strip()))
+
+
+def read_pso_results(file) -> List[Tuple[Tuple[int, ...], float, Optional[str]]]:
+    # (closed roads, max AQI, marker of the model logged before, None in the logs without marker)
+    results = []
+    closure_sets = []
+    marker = None
+    with open(file, errors = "replace") as f:
+        for line in f:
+            if MODEL_MARKER.match(line):
+                marker = MODEL_MARKER.match(line).group(0)
+                continue
+            roads = NEW_ROADS_SET.match(line)
+            if roads:
+                closure_sets.append(parse_roads(roads.group(1)))
+                continue
+            aqi = AQI.match(line)
+            closed_roads = CLOSED_ROADS.search(line)
+            if aqi and closed_roads:
+                results.append((parse_roads(closed_roads.group(1)), float(aqi.group(1)), marker))
+            elif aqi and closure_sets:
+                results.append((closure_sets.pop(0), float(aqi.group(1)), marker))
+            elif line.startswith("process initial fitness"):
+                # A block whose log was cut before its AQIs
+                closure_sets = []
+    return results
+
+
+def read_saved_data(file) -> List[Tuple[Tuple[int, ...], float, Optional[str]]]:
+    # Written by the model itself, without marker
+    last_records: Dict[Tuple[int, ...], Tuple[int, float]] = {}
+    with open(file, errors = "replace") as f:
+        for line in f:
+            record = SAVED_DATA.search(line)
+            if record:
+                closed_roads, cycle, max_aqi = parse_roads(record.group(1)), int(record.group(2)), float(record.group(3))
+                if cycle >= last_records.get(closed_roads, (-1, 0.0))[0]:
+                    last_records[closed_roads] = (cycle, max_aqi)
+    return [(closed_roads, max_aqi, None) for closed_roads, (cycle, max_aqi) in last_records.items()]
+
+
+def load_prior_results(nb_steps, pso_results_files = None,
+                       saved_data_file = SAVED_DATA_FILE) -> Tuple[Dict[Tuple[int, ...], float], Dict[Tuple[int, ...], float]]:
+    '''
+    Closure sets evaluated in previous runs, as two dicts:
+    - known: max AQI of the closure sets simulated with the current model and nb_steps, averaged
+      over their evaluations
+    - ranked: for the other ones, their best rank in their own log, as a fraction of its length
+      (0.0: the best closure set of the log), since max AQIs of other models or lengths can't
+      be compared
+    '''
+    sources: Dict[Tuple[str, Optional[str]], List[Tuple[Tuple[int, ...], float]]] = {}
+    files = pso_results_files if pso_results_files is not None else PSO_RESULTS_FILES
+    for file in files:
+        for closed_roads, max_aqi, marker in read_pso_results(file):
+            sources.setdefault((str(file), marker), []).append((closed_roads, max_aqi))
+    if saved_data_file is not None and Path(saved_data_file).exists():
+        for closed_roads, max_aqi, marker in read_saved_data(saved_data_file):
+            sources.setdefault((str(saved_data_file), marker), []).append((closed_roads, max_aqi))
+
+    current_marker = model_marker(nb_steps)
+    evaluations: Dict[Tuple[int, ...], List[float]] = {}
+    ranked: Dict[Tuple[int, ...], float] = {}
+    for (file, marker), results in sources.items():
+        if marker == current_marker:
+            for closed_roads, max_aqi in results:
+                evaluations.setdefault(closed_roads, []).append(max_aqi)
+            continue
+        for rank, (closed_roads, max_aqi) in enumerate(sorted(results, key = lambda result: result[1])):
+            ranked[closed_roads] = min(ranked.get(closed_roads, 1.0), rank / len(results))
+    known = {closed_roads: sum(max_aqis) / len(max_aqis) for closed_roads, max_aqis in evaluations.items()}
+    return known, {closed_roads: rank for closed_roads, rank in ranked.items() if closed_roads not in known}
+
+
+def top_closure_sets(k, nb_steps, prior_results = None) -> List[Tuple[Tuple[int, ...], Optional[float]]]:
+    # The k best previous closure sets, with their max AQI when it is known: the known ones by
+    # max AQI first, then the other ones by rank
+    if k <= 0:
+        return []
+    known, ranked = prior_results if prior_results is not None else load_prior_results(nb_steps)
+    closure_sets = [(closed_roads, known[closed_roads]) for closed_roads in sorted(known, key = known.get)]
+    closure_sets += [(closed_roads, None) for closed_roads in sorted(ranked, key = ranked.get)]
+    return closure_sets[:k]
+
+
+def top_solutions(k, space, nb_steps, prior_results = None, resimulate = None) -> List[Tuple[List[bool], Optional[float]]]:
+    '''
+    The k best previous closure sets that are exact and feasible points of the search space
+    (closing all its fixed roads and whole units only), as (vector, max AQI). The max AQI is
+    None when the solution has to be simulated: it was not simulated with the current model and
+    nb_steps, or RESIMULATE is on.
+    '''
+    if k <= 0:
+        return []
+    resimulate = resimulate if resimulate is not None else RESIMULATE
+    prior_results = prior_results if prior_results is not None else load_prior_results(nb_steps)
+    road_graph = get_road_graph()
+    solutions = []
+    for closed_roads, max_aqi in top_closure_sets(sum(map(len, prior_results)), nb_steps, prior_results):
+        vector = space.to_vector(closed_roads)
+        if space.to_closed_roads(vector) == list(closed_roads) and road_graph.is_feasible(closed_roads):
+            solutions.append((vector, None if resimulate else max_aqi))
+            if len(solutions) == k:
+                break
+    print("Warm start:", len(solutions), "solutions out of", sum(map(len, prior_results)), "previous evaluations,",
+          sum(max_aqi is None for vector, max_aqi in solutions), "to simulate again")
+    return solutions
@@ -0,0 +1,226 @@
+import asyncio
+import math
+import random
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parents[1] / "Common"))
+from evaluator import Evaluator, create_evaluator
+from portfolio import portfolio_best
+from search_space import PHODIBO_2023, SearchSpace, street_groups
+from sensitivity import closure_probabilities, load_sensitivity_index
+
+# Batch Bayesian optimization: a Gaussian process with a Tanimoto kernel is fitted on all the
+# closure sets evaluated so far, and each round proposes BATCH_SIZE new closure sets (one per
+# simulation slot) maximizing the expected improvement of the max AQI
+evaluator: Evaluator
+
+
+# Evaluation backend (see Common/evaluator.py): "gama", "daemon", "queue" or "synthetic"
+EVALUATOR = "gama"
+
+# Experiment and Gama-server constants
+MY_SERVER_URL = "localhost"
+MY_SERVER_PORT = 6868
+
+# Number of closure sets simulated together in each round
+BATCH_SIZE = 8
+# Gama-servers used by the "gama" backend: (url, port, number of experiments run concurrently on the server)
+GAMA_SERVERS = [(MY_SERVER_URL, MY_SERVER_PORT, BATCH_SIZE)]
+
+# Total number of simulations, initial design included
+MAX_EVALUATIONS = 400
+# Random closure sets simulated before the first fit of the surrogate
+NB_INITIAL = 4 * BATCH_SIZE
+
+# Probability for a free road to be closed in the initial design and the random candidates
+proba_closed_at_init = 0.1
+
+# Candidates scored by the acquisition function for each proposal: mutations of the best
+# closure sets evaluated so far, and random closure sets
+NB_PARENTS = 10
+NB_MUTATIONS = 100
+NB_RANDOM_CANDIDATES = 500
+MAX_FLIPS = 3
+
+# Noise variances (of the normalized AQI) tried when fitting the Gaussian process
+NOISE_GRID = [1e-3, 1e-2, 1e-1, 0.3]
+
+# The roads belonging to the initial solution are always closed and the roads of ROAD_CANT_CLOSE always open
+# With STREET_GROUPS, each entry is a whole street instead of a single road segment
+STREET_GROUPS = False
+space = SearchSpace(PHODIBO_2023, groups = street_groups() if STREET_GROUPS else None)
+
+# With USE_SENSITIVITY_PRIOR, the roads lowering the AQI the most in the screening
+# (Tools/Sensitivity Screening.py) are the most likely to be closed in the random closure sets
+USE_SENSITIVITY_PRIOR = True
+init_probabilities = closure_probabilities(space.units, load_sensitivity_index() if USE_SENSITIVITY_PRIOR else {},
+                                           proba_closed_at_init)
+
+# Common random numbers: all the closure sets of the run are simulated with the same seed, so that
+# the surrogate is fitted on differences due to the closures only
+#   "run": a single seed for the whole run
+#   "none": a new seed for every simulation, chosen by GAMA
+SEEDING_POLICY = "run"
+RUN_SEED = random.randrange(1, 2**31)
+
+
+def simulation_seed():
+    if SEEDING_POLICY == "run":
+        return float(RUN_SEED)
+    return 0.0
+
+
+def tanimoto_kernel(X, Y):
+    # Similarity of two closure sets: number of roads closed in both / number of roads closed in either
+    intersection = X @ Y.T
+    union = X.sum(axis = 1)[:, None] + Y.sum(axis = 1)[None, :] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1), 1.0)
+
+
+class TanimotoGP:
+    '''
+    Gaussian process regression on closure vectors, with a Tanimoto kernel
+    '''
+    def fit(self, X, y):
+        self.X = np.asarray(X, dtype = float)
+        y = np.asarray(y, dtype = float)
+        self.y_mean = y.mean()
+        self.y_std = y.std() if y.std() > 0 else 1.0
+        y = (y - self.y_mean) / self.y_std
+
+        # The noise variance maximizing the marginal likelihood
+        K = tanimoto_kernel(self.X, self.X)
+        best_likelihood = -math.inf
+        for noise in NOISE_GRID:
+            L = np.linalg.cholesky(K + noise * np.eye(len(y)))
+            alpha = np.linalg.solve(L.T, np.linalg.solve(L, y))
+            likelihood = -0.5 * y @ alpha - np.log(np.diag(L)).sum()
+            if likelihood > best_likelihood:
+                best_likelihood = likelihood
+                self.noise, self.L, self.alpha = noise, L, alpha
+        return self
+
+    def predict(self, X):
+        X = np.asarray(X, dtype = float)
+        K_s = tanimoto_kernel(X, self.X)
+        mean = K_s @ self.alpha
+        v = np.linalg.solve(self.L, K_s.T)
+        variance = np.maximum(1.0 - (v * v).sum(axis = 0), 1e-12)
+        return mean * self.y_std + self.y_mean, np.sqrt(variance) * self.y_std
+
+
+def expected_improvement(mean, std, best):
+    # Expected decrease of the max AQI below the best one found so far
+    z = (best - mean) / std
+    cdf = 0.5 * (1.0 + np.array([math.erf(v / math.sqrt(2.0)) for v in z]))
+    pdf = np.exp(-0.5 * z * z) / math.sqrt(2.0 * math.pi)
+    return (best - mean) * cdf + std * pdf
+
+
+def candidates(X, y):
+    pool = []
+    for i in np.argsort(y)[:NB_PARENTS]:
+        for _ in range(NB_MUTATIONS):
+            candidate = list(X[i])
+            for r in random.sample(range(space.dimension), random.randint(1, MAX_FLIPS)):
+                candidate[r] = not candidate[r]
+            pool.append(candidate)
+    pool += [space.random_vector(init_probabilities) for _ in range(NB_RANDOM_CANDIDATES)]
+    return pool
+
+
+def propose_batch(X, y, batch_size):
+    '''
+    Choose batch_size new closure vectors with the "kriging believer" heuristic: after each choice,
+    the Gaussian process is refitted as if the candidate had been simulated and its AQI were the
+    predicted one, so that the next choices go elsewhere
+    '''
+    X, y = [list(x) for x in X], list(y)
+    known = {tuple(x) for x in X}
+    batch = []
+    pool = candidates(X, y)
+    while len(batch) < batch_size:
+        gp = TanimotoGP().fit(X, y)
+        mean, std = gp.predict(pool)
+        for i in np.argsort(-expected_improvement(mean, std, min(y))):
+            candidate = list(pool[i])
+            space.repair(candidate)
+            if tuple(candidate) not in known:
+                break
+        else:
+            candidate = space.random_vector(init_probabilities)
+            space.repair(candidate)
+        known.add(tuple(candidate))
+        batch.append(candidate)
+        X.append(candidate)
+        y.append(gp.predict([candidate])[0][0])
+    return batch
+
+
+async def evaluate_batch(vectors):
+    closure_sets = [space.to_closed_roads(vector) for vector in vectors]
+    results = await evaluator.evaluate_many(closure_sets, [simulation_seed()] * len(closure_sets))
+    for metrics in results:
+        print("MAX_AQI =", metrics["max_aqi"])
+    return [metrics["max_aqi"] for metrics in results]
+
+
+async def bayesian_optimization():
+    # Initial design: the initial solution alone and random closure sets
+    X = [[False] * space.dimension]
+    for _ in range(NB_INITIAL - 1):
+        vector = space.random_vector(init_probabilities)
+        space.repair(vector)
+        X.append(vector)
+    y = await evaluate_batch(X)
+
+    round = 0
+    while len(X) < MAX_EVALUATIONS:
+        round += 1
+        # When run in a portfolio (Tools/Portfolio Runner.py), the surrogate also learns the best closure set of all the optimizers
+        shared_best = await portfolio_best(evaluator, space)
+        if shared_best is not None and shared_best[0] not in X:
+            X.append(shared_best[0])
+            y.append(shared_best[1])
+        batch = propose_batch(X, y, min(BATCH_SIZE, MAX_EVALUATIONS - len(X)))
+        X += batch
+        y += await evaluate_batch(batch)
+
+        best = int(np.argmin(y))
+        print("Round: {}\tEvaluations: {}\tBest closed roads: {}\tBest AQI: {}".format(
+            round, len(X), space.to_closed_roads(X[best]), y[best]))
+
+    best = int(np.argmin(y))
+    return space.to_closed_roads(X[best]), y[best]
+
+
+async def main():
+    global evaluator
+
+    evaluator = create_evaluator(EVALUATOR, GAMA_SERVERS)
+    try:
+        await evaluator.start()
+    except Exception as e:
+        print("error while initializing", e)
+        return
+
+    # Start the timer
+    start_time = time.time()
+
+    closed_roads, max_aqi = await bayesian_optimization()
+    print("Best closed roads:", closed_roads)
+    print("Best fitness (air quality index):", max_aqi)
+
+    await evaluator.close()
+
+    # End the timer
+    end_time = time.time()
+    total_time = end_time - start_time
+    print("Total time:", total_time, "seconds")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,133 +1,72 @@
 import asyncio
-import json
-import uuid
-from typing import Dict
-from asyncio import Future
-
-from gama_client.base_client import GamaBaseClient
-from gama_client.command_types import CommandTypes
-from gama_client.message_types import MessageTypes
-
+import sys
 import random
 import time
 import os
+import queue
+import multiprocessing
 from pathlib import Path
 
-experiment_future: Future
-play_future: Future
-pause_future: Future
-expression_future: Future
-step_future: Future
-stop_future: Future
-reload_future: Future
-
-
-async def message_handler(message):
-    # print("received message:", message)
-    if "command" in message:
-        if message["command"]["type"] == CommandTypes.Load.value:
-            experiment_future.set_result(message)
-        elif message["command"]["type"] == CommandTypes.Play.value:
-            play_future.set_result(message)
-        elif message["command"]["type"] == CommandTypes.Pause.value:
-            pause_future.set_result(message)
-        elif message["command"]["type"] == CommandTypes.Expression.value:
-            expression_future.set_result(message)
-        elif message["command"]["type"] == CommandTypes.Step.value:
-            step_future.set_result(message)
-        elif message["command"]["type"] == CommandTypes.Stop.value:
-            stop_future.set_result(message)
-        elif message["command"]["type"] == CommandTypes.Reload.value:
-            reload_future.set_result(message)
-            
-            
-async def run_GAMA_simulation(client, experiment_id):
-    # 1 steps = 15 seconds
-    # 4 steps = 1 minute
-    # 240 steps = 1 hr
-    # 5760 steps = 1 day 
-    # 11520 steps = 1 weekend 
-    # 40320 steps = 1 week
-    global step_future, expression_future
-    print("Running the experiment")
-    
-    # Run the GAMA simulation for n + 2 steps (2 blank steps for initialization prob)
-    step_future = asyncio.get_running_loop().create_future()
-    await client.step(experiment_id, 11520 + 2, True)
-    gama_response = await step_future
-    if gama_response["type"] != MessageTypes.CommandExecutedSuccessfully.value:
-        print("Unable to execute the experiment", gama_response)
-        return
+sys.path.append(str(Path(__file__).parents[1] / "Common"))
+from evaluator import Evaluator, create_evaluator
+from gama_pool import NB_STEPS
+from portfolio import portfolio_best
+from search_space import PHODIBO, SearchSpace, street_groups
+from sensitivity import closure_probabilities, load_sensitivity_index
+from warm_start import top_solutions
 
-    # # screenshoting
-    # dir = str(Path(__file__).parents[0] / "results")
-    # os.makedirs(dir, exist_ok=True)
-    # name = "-".join([str(road) for road in closed_roads]) + ".png"
-    # print("Saving a screenshot to", dir, name)
-    # take_snapshot_command = r"save snapshot('my_display') to:'" + dir.replace('\\', '/') + "/" + name + "';"
-    # expression_future = asyncio.get_running_loop().create_future()
-    # await client.expression(experiment_id, take_snapshot_command)
-    # gama_response = await expression_future
-    # if gama_response["type"] != MessageTypes.CommandExecutedSuccessfully.value:
-    #     print("Unable to save the display", gama_response)
-    #     return
-
-
-async def kill_GAMA_simulation(client, experiment_id):
-    global stop_future
-    print("killing the GAMA simulation")
-    # Kill the GAMA simulation
-    stop_future = asyncio.get_running_loop().create_future()
-    await client.stop(experiment_id)
-    gama_response = await stop_future
-    if gama_response["type"] != MessageTypes.CommandExecutedSuccessfully.value:
-        print("Unable to stop the experiment", gama_response)
-        return            
-  
-  
-async def get_max_aqi(client, experiment_id):
-    global expression_future
-    expression_future = asyncio.get_running_loop().create_future()
-    await client.expression(experiment_id, r"max_aqi")
-    gama_response = await expression_future
-    print("MAX_AQI =", gama_response["content"])
-    return float(gama_response["content"])    
-
-
-# Define the async function for GAMA simulation
-async def reload_gama_simulation(individual):
-    global expression_future, step_future, reload_future
-
-    # Update the inital parameters(current_node) to a new parameters (new_params) by merging it with the list of adjacent
-    new_params = [{"type": "list<int>", "name": "Closed roads", "value": [i for i,v in enumerate(individual) if v]},
-                  {"type": "string", "name": "Id", "value": str(uuid.uuid1())}]
-    print("NEW_ROADS_SET =", new_params)
-    
-    # Load the GAMA model with the new parameters
-    reload_future = asyncio.get_running_loop().create_future()
-    await client.reload(experiment_id, new_params)
-    res_reload = await reload_future
-    if res_reload["type"] != MessageTypes.CommandExecutedSuccessfully.value:
-        print("Unable to reload the simulation", res_reload)
-        return
-    await run_GAMA_simulation(client, experiment_id)
-    return await get_max_aqi(client, experiment_id)  
+
+# Common random numbers: candidates that are compared with each other are simulated with the same seed
+#   "generation": one seed per generation, shared by all the individuals evaluated in it
+#   "run": a single seed for the whole run
+#   "none": a new seed for every simulation, chosen by GAMA
+SEEDING_POLICY = "generation"
+RUN_SEED = random.randrange(1, 2**31)
+
+
+def simulation_seed(generation):
+    if SEEDING_POLICY == "generation":
+        return float(RUN_SEED + generation)
+    if SEEDING_POLICY == "run":
+        return float(RUN_SEED)
+    return 0.0
 
 
 # Number of individuals in each generation
 POPULATION_SIZE = 1000
 
-PHODIBO = [10, 11, 82, 132, 133, 158, 201, 202, 203, 271, 274, 276, 277, 279, 292, 302, 303, 304, 305, 306, 307, 308, 309, 310, 311, 344, 425, 426, 427, 428, 540, 583, 585, 640]
-PHODIBO_BOOLEAN = [True] * len(PHODIBO)
-remain_roads = [x for x in range(643) if x not in PHODIBO]
+# The chromosomes only hold the free roads: the pedestrian area is always closed
+# and the roads of ROAD_CANT_CLOSE always open
+# With STREET_GROUPS, each entry is a whole street instead of a single road segment
+STREET_GROUPS = False
+space = SearchSpace(PHODIBO, groups = street_groups() if STREET_GROUPS else None)
+
+# With USE_SENSITIVITY_PRIOR, the random genes (initial population and mutations) close the roads
+# lowering the AQI the most in the screening (Tools/Sensitivity Screening.py) more often
+USE_SENSITIVITY_PRIOR = True
+gene_probabilities = closure_probabilities(space.units, load_sensitivity_index() if USE_SENSITIVITY_PRIOR else {}, 0.5)
 
+# Warm start: the WARM_START_SOLUTIONS best closure sets of the previous runs (Common/warm_start.py)
+# join the initial population with the fitness of their known max AQI, or simulated with the other
+# individuals when it is not known for this model and NB_STEPS
+WARM_START_SOLUTIONS = 50
 
-async def cal_fitness(gnome):
-    # Get the AQI for the current set of closed roads (chromosome)
-    max_aqi = await reload_gama_simulation(gnome)
+
+evaluator: Evaluator
+
+
+async def cal_fitness(gnomes, seed):
+    # Infeasible chromosomes (disconnecting the network) are repaired before being simulated,
+    # by reopening as few roads as possible
+    for gnome in gnomes:
+        space.repair(gnome)
+    # Get the AQI for the sets of closed roads (chromosomes), all simulated in one batch
+    results = await evaluator.evaluate_many([space.to_closed_roads(gnome) for gnome in gnomes],
+                                            [seed] * len(gnomes))
+    for metrics in results:
+        print("MAX_AQI =", metrics["max_aqi"])
     # Calculate fitness as the inverse of AQI (lower AQI is better)
-    fitness = 1.0 / max_aqi
-    return fitness
+    return [1.0 / metrics["max_aqi"] for metrics in results]
 
 
 class Individual(object):
@@ -144,7 +83,7 @@ class Individual(object):
         '''
         create random genes for mutation
         '''
-        gene = [random.choice([True, False]) for _ in range(len(remain_roads))]
+        gene = space.random_vector(gene_probabilities)
         return gene
 
 
@@ -153,18 +92,17 @@ class Individual(object):
         '''
         create chromosome or string of genes
         '''
-        remaining_genes = self.mutated_genes()
-        return PHODIBO_BOOLEAN + remaining_genes
+        return self.mutated_genes()
 
 
-    async def mate(self, par2):
+    def mate(self, par2):
         '''
         Perform mating and produce new offspring
         '''
 
         # chromosome for offspring
         child_chromosome = []
-        for gp1, gp2 in zip(self.chromosome, par2.chromosome):	
+        for i, (gp1, gp2) in enumerate(zip(self.chromosome, par2.chromosome)):
 
             # random probability
             prob = random.random()
@@ -182,55 +120,58 @@ class Individual(object):
             # otherwise insert random gene(mutate),
             # for maintaining diversity
             else:
-                child_chromosome.append(self.mutated_genes())
+                child_chromosome.append(random.random() < gene_probabilities[i])
 
-        fitness = await cal_fitness(child_chromosome)
         # create new Individual(offspring) using
-        # generated chromosome for offspring
-        return Individual(child_chromosome, fitness)
+        # generated chromosome for offspring,
+        # its fitness is computed with the rest of the generation
+        return Individual(child_chromosome)
 
 
 
 # Experiment and Gama-server constants
 MY_SERVER_URL = "localhost"
 MY_SERVER_PORT = 6868
-GAML_FILE_PATH_ON_SERVER = str(Path(__file__).parents[1] / "Hoan Kiem Air Model" / "models" / "HKAM.gaml" ).replace('\\','/')
-EXPERIMENT_NAME = "exp"
 
+# Evaluation backend (see Common/evaluator.py): "gama", "daemon", "queue" or "synthetic"
+EVALUATOR = "gama"
+# Gama-servers used by the "gama" backend: (url, port, number of experiments run concurrently on the server)
+GAMA_SERVERS = [(MY_SERVER_URL, MY_SERVER_PORT, 4)]
 
-# Driver code
-async def main():
-    
-    global experiment_future
-    global client
-    global experiment_id
- 
-    # Initial parameter
-    MY_EXP_INIT_PARAMETERS = [{"type": "list<int>", "name": "Closed roads", "value": PHODIBO},
-                                {"type": "string", "name": "Id", "value": str(uuid.uuid1())}]
 
-    # Connect to the GAMA server
-    client = GamaBaseClient(MY_SERVER_URL, MY_SERVER_PORT, message_handler)
-    await client.connect(ping_interval = None)
+# Island model: each island evolves its own sub-population against its own GAMA server
+# (one process per island, with its own evaluator) and sends its elites to the next island of the ring every
+# MIGRATION_INTERVAL generations. The POPULATION_SIZE is split between the islands.
+ISLAND_MODE = False
+ISLAND_SERVERS = [("localhost", 6868, 4), ("localhost", 6869, 4), ("localhost", 6870, 4), ("localhost", 6871, 4)]
+MIGRATION_INTERVAL = 5
+NB_MIGRANTS = 10
 
-    # Load the model
-    print("Initializing GAMA model")
-    experiment_future = asyncio.get_running_loop().create_future()
-    await client.load(GAML_FILE_PATH_ON_SERVER, EXPERIMENT_NAME, False, False, False, True, MY_EXP_INIT_PARAMETERS)
-    gama_response = await experiment_future
 
-    # Get experiment id of the GAMA simulation in the model
-    try:
-        experiment_id = gama_response["content"]
-    except Exception as e:
-        print("error while initializing", gama_response, e)
-        return
-    
-    # Start the timer
-    start_time = time.time()
-    
-    global POPULATION_SIZE
- 
+def migrate(population, island_index, inboxes):
+    '''
+    Send the elites of the island to the next island of the ring and
+    replace the worst individuals by the immigrants received so far
+    '''
+    population = sorted(population, key = lambda x:x.fitness, reverse = True)
+
+    outbox = inboxes[(island_index + 1) % len(inboxes)]
+    for ind in population[:NB_MIGRANTS]:
+        outbox.put((ind.chromosome, ind.fitness))
+
+    immigrants = []
+    while len(immigrants) < NB_MIGRANTS:
+        try:
+            chromosome, fitness = inboxes[island_index].get_nowait()
+        except queue.Empty:
+            break
+        immigrants.append(Individual(chromosome, fitness))
+
+    print("Island {}: {} immigrants received".format(island_index, len(immigrants)))
+    return population[:len(population) - len(immigrants)] + immigrants
+
+
+async def evolve(population_size, island_index = None, inboxes = None):
     #current generation
     generation = 1
 
@@ -244,15 +185,28 @@ async def main():
     previous_best_fitness = None
  
     # create initial population
-    for _ in range(POPULATION_SIZE):
-        gnome = Individual.create_gnome()
-        fitness = await cal_fitness(gnome)
-        ind = Individual(gnome, fitness)
-        population.append(ind)
+    population = []
+    solutions = top_solutions(min(WARM_START_SOLUTIONS, population_size), space, NB_STEPS)
+    population += [Individual(gnome, 1.0 / max_aqi) for gnome, max_aqi in solutions if max_aqi is not None]
+    gnomes = [gnome for gnome, max_aqi in solutions if max_aqi is None]
+    gnomes += [Individual.create_gnome() for _ in range(population_size - len(population) - len(gnomes))]
+    for gnome, fitness in zip(gnomes, await cal_fitness(gnomes, simulation_seed(0))):
+        population.append(Individual(gnome, fitness))
 
 
     while not found:
 
+        # Exchange elites with the other islands
+        if inboxes is not None and generation % MIGRATION_INTERVAL == 0:
+            population = migrate(population, island_index, inboxes)
+
+        # When run in a portfolio (Tools/Portfolio Runner.py), the best closure set of all the
+        # optimizers replaces the worst individual
+        shared_best = await portfolio_best(evaluator, space)
+        if shared_best is not None and 1.0 / shared_best[1] > max(ind.fitness for ind in population):
+            population.remove(min(population, key = lambda x:x.fitness))
+            population.append(Individual(shared_best[0], 1.0 / shared_best[1]))
+
         # sort the population in increasing order of fitness score
         population = sorted(population, key = lambda x:x.fitness)
   
@@ -274,23 +228,29 @@ async def main():
 
         # Perform Elitism, that mean 10% of fittest population
         # goes to the next generation
-        s = int((10*POPULATION_SIZE)/100)
+        s = int((10*population_size)/100)
         new_generation.extend(population[:-s])
 
         # From 50% of fittest population, Individuals
         # will mate to produce offspring
-        s = int((90*POPULATION_SIZE)/100)
+        s = int((90*population_size)/100)
+        children = []
         for _ in range(s):
             parent1 = random.choice(population[:s])
             parent2 = random.choice(population[:s])
-            child = await parent1.mate(parent2)
-            new_generation.append(child)
+            children.append(parent1.mate(parent2))
+
+        # The offspring of the generation are simulated together
+        fitnesses = await cal_fitness([child.chromosome for child in children], simulation_seed(generation))
+        for child, fitness in zip(children, fitnesses):
+            child.fitness = fitness
+        new_generation.extend(children)
 
         population = new_generation
 
         print("Generation: {}\tRoads Set: {}\tFitness: {}".format(
         generation,
-        [i for i,v in enumerate(population[0].chromosome) if v],  # Convert integers to strings
+        space.to_closed_roads(population[0].chromosome),
         population[0].fitness
         ))
 
@@ -299,11 +259,95 @@ async def main():
 
     print("Generation: {}\tRoads Set: {}\tFitness: {}".format(
         generation,
-        [i for i,v in enumerate(population[0].chromosome) if v],  # Convert integers to strings
+        space.to_closed_roads(population[0].chromosome),
         population[0].fitness
     ))
+    return population
+
+
+async def run_island(island_index, server, population_size, inboxes, results):
+    global evaluator
+
+    evaluator = create_evaluator(EVALUATOR, [server], NB_STEPS)
+    try:
+        await evaluator.start()
+    except Exception as e:
+        print("error while initializing island", island_index, e)
+        results.put(None)
+        return
+
+    # A result is always put, None when the evolution failed, so that the main process does not wait for it
+    best = None
+    try:
+        population = await evolve(population_size, island_index, inboxes)
+        best = max(population, key = lambda x:x.fitness)
+    except Exception as e:
+        print("Island", island_index, "failed:", repr(e))
+    finally:
+        results.put((best.chromosome, best.fitness) if best is not None else None)
+        await evaluator.close()
+
+
+def island_process(island_index, server, population_size, inboxes, results):
+    random.seed()
+    asyncio.run(run_island(island_index, server, population_size, inboxes, results))
+    # Elites sent to an island that has already stopped are never read,
+    # do not wait for them to be flushed before exiting
+    for inbox in inboxes:
+        inbox.cancel_join_thread()
+
+
+def island_model():
+    nb_islands = len(ISLAND_SERVERS)
+    inboxes = [multiprocessing.Queue() for _ in range(nb_islands)]
+    results = multiprocessing.Queue()
+
+    islands = [multiprocessing.Process(target = island_process,
+                                       args = (i, server, POPULATION_SIZE // nb_islands, inboxes, results))
+               for i, server in enumerate(ISLAND_SERVERS)]
+    for island in islands:
+        island.start()
+
+    bests = []
+    while len(bests) < len(islands):
+        try:
+            bests.append(results.get(timeout = 1.0))
+        except queue.Empty:
+            # An island killed before putting its result
+            if all(island.exitcode is not None for island in islands) and results.empty():
+                print(len(islands) - len(bests), "islands stopped without result")
+                break
+    for island in islands:
+        island.join()
+
+    bests = [best for best in bests if best is not None]
+    if not bests:
+        print("No island returned a result")
+        return
+    chromosome, fitness = max(bests, key = lambda x:x[1])
+    print("Best of all islands\tRoads Set: {}\tFitness: {}".format(
+        space.to_closed_roads(chromosome),
+        fitness
+    ))
+
+
+# Driver code
+async def main():
+    global evaluator
+
+    evaluator = create_evaluator(EVALUATOR, GAMA_SERVERS, NB_STEPS)
+    try:
+        await evaluator.start()
+    except Exception as e:
+        print("error while initializing", e)
+        return
+    
+    # Start the timer
+    start_time = time.time()
+    
+    await evolve(POPULATION_SIZE)
  
-    await kill_GAMA_simulation(client, experiment_id)
+    await evaluator.close()
  
     # End the timer
     end_time = time.time()
@@ -311,4 +355,9 @@ async def main():
     print("Total time:", total_time, "seconds")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if ISLAND_MODE:
+        start_time = time.time()
+        island_model()
+        print("Total time:", time.time() - start_time, "seconds")
+    else:
+        asyncio.run(main())
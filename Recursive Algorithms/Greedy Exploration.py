@@ -1,113 +1,77 @@
 import asyncio
-import json
 import os
+import random
+import sys
 import time
-import uuid
-from datetime import datetime
 from typing import Dict, List
-from asyncio import Future
 from pathlib import Path
 
-import igraph as ig
-import matplotlib.pyplot as plt
-
-from gama_client.base_client import GamaBaseClient
-from gama_client.command_types import CommandTypes
-from gama_client.message_types import MessageTypes
-
-
-experiment_future: Future
-play_future: Future
-pause_future: Future
-expression_future: Future
-step_future: Future
-stop_future: Future
-reload_future: Future
-
-
-async def message_handler(message):
-    # print("received message:", message)
-    if "command" in message:
-        if message["command"]["type"] == CommandTypes.Load.value:
-            experiment_future.set_result(message)
-        elif message["command"]["type"] == CommandTypes.Play.value:
-            play_future.set_result(message)
-        elif message["command"]["type"] == CommandTypes.Pause.value:
-            pause_future.set_result(message)
-        elif message["command"]["type"] == CommandTypes.Expression.value:
-            expression_future.set_result(message)
-        elif message["command"]["type"] == CommandTypes.Step.value:
-            step_future.set_result(message)
-        elif message["command"]["type"] == CommandTypes.Stop.value:
-            stop_future.set_result(message)
-        elif message["command"]["type"] == CommandTypes.Reload.value:
-            reload_future.set_result(message)
-
-
-async def get_max_aqi(client, experiment_id):
-    global expression_future
-    expression_future = asyncio.get_running_loop().create_future()
-    await client.expression(experiment_id, r"max_aqi")
-    gama_response = await expression_future
-    print("MAX_AQI =", gama_response["content"])
-    return float(gama_response["content"])
-
-
-async def get_adjacent_roads(client, experiment_id, current_node):
-    global expression_future
-    expression_future = asyncio.get_running_loop().create_future()
-    exp = r"adjacent_roads(" + str(current_node) + ")"
-    await client.expression(experiment_id, exp)
-    gama_response = await expression_future
-
-    # Get "adjacent" of the current node
-    adjacent = json.loads(gama_response["content"])
+sys.path.append(str(Path(__file__).parents[1] / "Common"))
+from evaluator import Evaluator, create_evaluator
+from exploration_log import ExplorationLog
+from portfolio import portfolio_best
+from road_graph import get_road_graph
+from search_space import PHODIBO, SearchSpace, street_groups
+
+
+# Evaluation backend (see Common/evaluator.py): "gama", "daemon", "queue" or "synthetic"
+EVALUATOR = "gama"
+
+# Experiment and Gama-server constants
+MY_SERVER_URL = "localhost"
+MY_SERVER_PORT = 6868
+# (url, port, number of experiments run concurrently on the server): the children of a node are simulated together
+GAMA_SERVERS = [(MY_SERVER_URL, MY_SERVER_PORT, 4)]
+
+
+# The adjacent roads are computed locally, and the ones whose closure would close a road of
+# ROAD_CANT_CLOSE or disconnect the network are not explored
+roads = get_road_graph()
+
+# With STREET_GROUPS, the whole street of an adjacent road is closed at once
+STREET_GROUPS = False
+space = SearchSpace(PHODIBO, groups = street_groups() if STREET_GROUPS else None)
+
+
+def feasible_adjacent_roads(closed_roads):
+    # Units (roads or streets) to close next, as tuples of roads
+    adjacent = []
+    for road in roads.adjacent_roads(closed_roads):
+        unit = space.unit_of(road)
+        if unit is not None and unit not in adjacent and roads.is_feasible(closed_roads + list(unit)):
+            adjacent.append(unit)
     print("ADJACENT_ROADS =", adjacent)
     return adjacent
 
 
-async def GAMA_sim(client, experiment_id, closed_roads):
-    # 1 steps = 15 seconds
-    # 4 steps = 1 minute
-    # 240 steps = 1 hr
-    # 5760 steps = 1 day 
-    # 11520 steps = 1 weekend 
-    # 40320 steps = 1 week
-    global step_future, expression_future
-
-    print("Running the experiment")
-    # Run the GAMA simulation for n + 2 steps (2 blank steps for initialization prob)
-    step_future = asyncio.get_running_loop().create_future()
-    await client.step(experiment_id, 11520 + 2, True)
-    gama_response = await step_future
-    if gama_response["type"] != MessageTypes.CommandExecutedSuccessfully.value:
-        print("Unable to execute the experiment", gama_response)
-        return
+# Common random numbers: candidates that are compared with each other are simulated with the same seed
+#   "run": a single seed for the whole exploration, so that every node is compared with its
+#          parent and siblings under the same traffic realization
+#   "none": a new seed for every simulation, chosen by GAMA
+SEEDING_POLICY = "run"
+RUN_SEED = random.randrange(1, 2**31)
 
-    # screenshoting
-    # dir = str(Path(__file__).parents[0] / " Greedy Result ")
-    # os.makedirs(dir, exist_ok=True)
-    # name = "-".join([str(road) for road in closed_roads]) + ".png"
-    # print("Saving a screenshot to", dir, name)
-    # take_snapshot_command = r"save snapshot('my_display') to:'" + dir.replace('\\', '/') + "/" + name + "';"
-    # expression_future = asyncio.get_running_loop().create_future()
-    # await client.expression(experiment_id, take_snapshot_command)
-    # gama_response = await expression_future
-    # if gama_response["type"] != MessageTypes.CommandExecutedSuccessfully.value:
-    #     print("Unable to save the display", gama_response)
-    #     return
-
-
-async def kill_GAMA_simulation(client, experiment_id):
-    global stop_future
-    print("killing the GAMA simulation")
-    # Kill the GAMA simulation
-    stop_future = asyncio.get_running_loop().create_future()
-    await client.stop(experiment_id)
-    gama_response = await stop_future
-    if gama_response["type"] != MessageTypes.CommandExecutedSuccessfully.value:
-        print("Unable to stop the experiment", gama_response)
-        return
+
+def simulation_seed():
+    if SEEDING_POLICY == "run":
+        return float(RUN_SEED)
+    return 0.0
+
+
+# With LOG_EXPLORATION, the simulated nodes are written to Recursive Algorithms/exploration/
+# in the background, render them with Tools/Render Exploration.py
+LOG_EXPLORATION = True
+exploration_log: ExplorationLog = None
+
+
+def log_node(node):
+    if exploration_log is not None:
+        exploration_log.node(node.id, node.parent.id if node.parent else None, node.state, node.aqi)
+
+
+def log_current(node):
+    if exploration_log is not None:
+        exploration_log.current(node.id)
 
 
 count = -1 #nto start at 0
@@ -128,46 +92,7 @@ class Node:
         self.id: int = get_id()
 
 
-    def get_root(self) -> ig.Graph:
-        if self.parent:
-            return self.parent.get_root()
-        return ig.Graph(directed=True)
-
-
-    def to_graph(self, current_graph: ig.Graph) -> ig.Vertex:
-        root = self.get_root() if current_graph is None else current_graph
-        v = root.add_vertex(self.id)
-        v["state"]  = self.state
-        v["id"]     = self.id
-        for c in self.children:
-            child_vertex = c.to_graph(root)
-            root.add_edge(v.index, child_vertex.index)
-        return v
-
-
-def refresh_plot(root: Node, current_node: Node, ax, save_to_file: bool):
-    graph = root.to_graph(None).graph
-    plt.cla()
-    ig.plot(
-        graph,
-        target=ax,
-        layout="kk",
-        vertex_size=0.5,
-        vertex_color=["green" if g_id == root.id else "red" if g_id == current_node.id else "steelblue" for g_id in
-                      graph.vs["id"]],
-        vertex_frame_width=4.0,
-        vertex_frame_color="white",
-        vertex_label=[str(v_st[-1]) for v_st in graph.vs["state"]],
-        vertex_label_size=10.0,
-    )
-    plt.pause(0.1)
-    if save_to_file:
-        plt.savefig("exploration/" + str(datetime.now().strftime("%Y-%m-%d %Hh%M %Ssec")) + ".png")
-
-
-async def child_node(client: GamaBaseClient, experiment_id, current_node: Node, adjacent_roads):
-    global expression_future, step_future, reload_future
-
+def child_closed_roads(current_node: Node, adjacent_roads):
     # Update the inital parameters(current_node) to a new parameters (new_params) by
     # merging it with the list of adjacent
     new_closed_roads = current_node.state + adjacent_roads
@@ -178,44 +103,56 @@ async def child_node(client: GamaBaseClient, experiment_id, current_node: Node,
     #sorting
     new_closed_roads.sort()
 
-    new_params = [{"type": "list<int>", "name": "Closed roads", "value": new_closed_roads},
-                  {"type": "string", "name": "Id", "value": str(uuid.uuid1())}]
-    print("NEW_ROADS_SET =", new_params)
+    return new_closed_roads
 
-    # Load the GAMA model with the new parameters
-    reload_future = asyncio.get_running_loop().create_future()
-    await client.reload(experiment_id, new_params)
-    res_reload = await reload_future
-    if res_reload["type"] != MessageTypes.CommandExecutedSuccessfully.value:
-        print("Unable to reload the simulation", res_reload)
-        return
 
-    await GAMA_sim(client, experiment_id, new_closed_roads)
-    max_aqi = await get_max_aqi(client, experiment_id)
+async def child_nodes(evaluator: Evaluator, current_node: Node, adjacent):
+    # All the children of the current node are simulated in one batch
+    closure_sets = [child_closed_roads(current_node, list(adj)) for adj in adjacent]
+    results = await evaluator.evaluate_many(closure_sets, [simulation_seed()] * len(closure_sets))
 
-    return {"max_aqi": max_aqi, "closed_roads": new_closed_roads}
+    children = []
+    for new_closed_roads, metrics in zip(closure_sets, results):
+        print("MAX_AQI =", metrics["max_aqi"])
+        child_n = Node(new_closed_roads, current_node)
+        child_n.aqi = metrics["max_aqi"]
+        log_node(child_n)
+        children.append(child_n)
+    return children
 
 
-async def greedy_exploration(client: GamaBaseClient, experiment_id, current_node: Node, root: Node, ax):
+async def greedy_exploration(evaluator: Evaluator, current_node: Node, root: Node):
     # Run the GAMA simulation and get the list of closed_roads and max_aqi
-    await GAMA_sim(client, experiment_id, current_node.state)
-
-    max_aqi = await get_max_aqi(client, experiment_id)
+    max_aqi = (await evaluator.evaluate(current_node.state, simulation_seed()))["max_aqi"]
+    print("MAX_AQI =", max_aqi)
     current_node.aqi = max_aqi
-
-    # Plot the tree/graph (toggle comment)
-    # refresh_plot(root, current_node, ax, True)
+    if current_node is root:
+        log_node(root)
+
+    # When run in a portfolio (Tools/Portfolio Runner.py), the exploration goes on from the best
+    # closure set of all the optimizers when it is better than the current one
+    shared_best = await portfolio_best(evaluator, space)
+    if shared_best is not None and shared_best[1] < max_aqi:
+        current_node = Node(space.to_closed_roads(shared_best[0]), current_node)
+        current_node.parent.children.append(current_node)
+        current_node.aqi = max_aqi = shared_best[1]
+        print("Going on from the portfolio best, MAX_AQI =", max_aqi)
+        log_node(current_node)
+    log_current(current_node)
 
     while True:
-        # Call a function in GAMA to get a list of adjacent roads to the input roads
-        adjacent = await get_adjacent_roads(client, experiment_id, current_node.state)
+        # Get the list of adjacent roads to the input roads that can be closed
+        adjacent = feasible_adjacent_roads(current_node.state)
 
         # Generate child nodes and explore them recursively
-        for adj in adjacent:
-            child = await child_node(client, experiment_id, current_node, [adj])
-            child_n = Node(child["closed_roads"])
-            child_n.aqi = child["max_aqi"]
-            current_node.children += [child_n]
+        current_node.children += await child_nodes(evaluator, current_node, adjacent)
+
+        # No road can be closed from here without cutting the network
+        if not current_node.children:
+            print("Stopping exploration: no road left to close")
+            print("CLOSED_ROADS =", current_node.state)
+            print("MAX_AQI =", max_aqi)
+            return current_node
 
         # Find the child node with the lowest max_aqi for further exploration
         lowest_child = min(current_node.children, key=lambda x: x.aqi)
@@ -233,64 +170,47 @@ async def greedy_exploration(client: GamaBaseClient, experiment_id, current_node
         # call the greedy_exploration function again to get another list of adjacent to
         # that current node, start exploring again
         if not adjacent:
-            return await greedy_exploration(client, experiment_id, lowest_child, root, ax)
+            return await greedy_exploration(evaluator, lowest_child, root)
 
         # Print the closed_roads and max_aqi of the child node with the lowest max_aqi in the graph and explore it
         print("Exploring child node with lowest max_aqi:")
         print("CLOSED_ROADS =", lowest_child.state)
         print("MAX_AQI =", lowest_child.aqi)
 
-        return await greedy_exploration(client, experiment_id, lowest_child, root, ax)
+        return await greedy_exploration(evaluator, lowest_child, root)
 
 
 async def main():
-    global experiment_future
-
-    # Experiment and Gama-server constants
-    MY_SERVER_URL = "localhost"
-    MY_SERVER_PORT = 6868
-
-    GAML_FILE_PATH_ON_SERVER = str(Path(__file__).parents[1] / "Hoan Kiem Air Model" / "models" / "HKAM.gaml" ).replace('\\','/')
-    
-    EXPERIMENT_NAME = "exp"
+    global exploration_log
 
     # Initial parameter
     # Pedestrian area (Phố đi bộ Hồ Hoàn Kiếm)
-    root_node = [10, 11, 82, 132, 133, 158, 201, 202, 203, 271, 274, 276, 277, 279, 292, 302, 303, 304, 305, 306, 307, 308, 309, 310, 311, 344, 425, 426, 427, 428, 540, 583, 585, 640]
+    root_node = list(PHODIBO)
     print("Initial closed roads = ", root_node)
-    MY_EXP_INIT_PARAMETERS = [  {"type": "list<int>", "name": "Closed roads", "value": root_node},
-                                {"type": "string", "name": "Id", "value": str(uuid.uuid1())}]
     root = Node(root_node)
 
-    # Connect to the GAMA server
-    client = GamaBaseClient(MY_SERVER_URL, MY_SERVER_PORT, message_handler)
-    await client.connect(ping_interval=None)
-
-    # initialise a screen to plot the graph
-    ax = plt.subplots()
+    if LOG_EXPLORATION:
+        exploration_log = ExplorationLog()
+        print("Exploration written to", exploration_log.file)
 
     # Load the model
     print("Initializing GAMA model")
-    experiment_future = asyncio.get_running_loop().create_future()
-    await client.load(GAML_FILE_PATH_ON_SERVER, EXPERIMENT_NAME, False, False, False, True, MY_EXP_INIT_PARAMETERS)
-    gama_response = await experiment_future
-
-    # Get experiment id of the GAMA simulation in the model
+    evaluator = create_evaluator(EVALUATOR, GAMA_SERVERS)
     try:
-        experiment_id = gama_response["content"]
+        await evaluator.start()
     except Exception as e:
-        print("error while initializing", gama_response, e)
+        print("error while initializing", e)
         return
 
     # Start the timer
     start_time = time.time()
 
     # Run the greedy exploration algorithm to find the child node with the lowest max_aqi value
-    leaf = await greedy_exploration(client, experiment_id, root, root, ax)
-
-    await kill_GAMA_simulation(client, experiment_id)
+    leaf = await greedy_exploration(evaluator, root, root)
 
-    #refresh_plot(root, leaf, ax, False)
+    await evaluator.close()
+    if exploration_log is not None:
+        exploration_log.close()
 
     # End the timer
     end_time = time.time()
@@ -1,126 +1,129 @@
 import time
 import math
 import random
-import uuid
+import sys
+import gzip
+import json
 from pathlib import Path
 
 import os
 
 import asyncio
-import json
 from typing import Dict
-from asyncio import Future
-
-from gama_client.base_client import GamaBaseClient
-from gama_client.command_types import CommandTypes
-from gama_client.message_types import MessageTypes
-
-experiment_future: Future
-play_future: Future
-pause_future: Future
-expression_future: Future
-step_future: Future
-stop_future: Future
-reload_future: Future
-
-
-async def message_handler(message):
-    # print("received message:", message)
-    if "command" in message:
-        if message["command"]["type"] == CommandTypes.Load.value:
-            experiment_future.set_result(message)
-        elif message["command"]["type"] == CommandTypes.Play.value:
-            play_future.set_result(message)
-        elif message["command"]["type"] == CommandTypes.Pause.value:
-            pause_future.set_result(message)
-        elif message["command"]["type"] == CommandTypes.Expression.value:
-            expression_future.set_result(message)
-        elif message["command"]["type"] == CommandTypes.Step.value:
-            step_future.set_result(message)
-        elif message["command"]["type"] == CommandTypes.Stop.value:
-            stop_future.set_result(message)
-        elif message["command"]["type"] == CommandTypes.Reload.value:
-            reload_future.set_result(message)
-            
-            
-async def get_max_aqi(client, experiment_id):
-    global expression_future
-    expression_future = asyncio.get_running_loop().create_future()
-    await client.expression(experiment_id, r"max_aqi")
-    gama_response = await expression_future
-    print("MAX_AQI =", gama_response["content"])
-    return float(gama_response["content"])
-
-
-async def get_adjacent_roads(client, experiment_id, closed_roads):
-    global expression_future
-    expression_future = asyncio.get_running_loop().create_future()
-    exp = r"adjacent_roads(" + str(closed_roads) + ")"
-    await client.expression(experiment_id, exp)
-    gama_response = await expression_future
-
-    # Get "adjacent" roads to the current set of closed roads
-    adjacent = json.loads(gama_response["content"])
+
+sys.path.append(str(Path(__file__).parents[1] / "Common"))
+from evaluator import Evaluator, create_evaluator
+from gama_pool import NB_STEPS
+from portfolio import portfolio_best
+from road_graph import get_road_graph
+from search_space import PHODIBO, SearchSpace, street_groups
+from sensitivity import load_sensitivity_index, unit_preferences
+from warm_start import top_closure_sets
+
+
+# Evaluation backend (see Common/evaluator.py): "gama", "daemon", "queue" or "synthetic"
+EVALUATOR = "gama"
+
+# Experiment and Gama-server constants
+MY_SERVER_URL = "localhost"
+MY_SERVER_PORT = 6868
+GAMA_SERVERS = [(MY_SERVER_URL, MY_SERVER_PORT, 1)]
+
+
+# The adjacent roads are computed locally, and the ones whose closure would close a road of
+# ROAD_CANT_CLOSE or disconnect the network are not explored
+roads = get_road_graph()
+
+# With STREET_GROUPS, the whole street of an adjacent road is closed at once
+STREET_GROUPS = False
+space = SearchSpace(PHODIBO, groups = street_groups() if STREET_GROUPS else None)
+
+# With USE_SENSITIVITY_PRIOR, the rollouts close the roads lowering the AQI the most in the
+# screening (Tools/Sensitivity Screening.py) more often
+USE_SENSITIVITY_PRIOR = True
+sensitivity_index = load_sensitivity_index() if USE_SENSITIVITY_PRIOR else {}
+
+# Warm start from the previous runs (Common/warm_start.py): the rollouts close more often the roads
+# closed by their WARM_START_SOLUTIONS best closure sets. The logs are only read on the first rollout.
+WARM_START_SOLUTIONS = 20
+WARM_START_WEIGHT = 1.0
+prior_road_frequencies: Dict[int, float] = None
+
+
+def road_frequencies() -> Dict[int, float]:
+    # Share of the best previous closure sets closing each road
+    global prior_road_frequencies
+    if prior_road_frequencies is None:
+        best_closure_sets = [closed_roads for closed_roads, max_aqi in top_closure_sets(WARM_START_SOLUTIONS, NB_STEPS)]
+        prior_road_frequencies = {road: sum(road in closed_roads for closed_roads in best_closure_sets) / len(best_closure_sets)
+                                  for road in set().union(*best_closure_sets)} if best_closure_sets else {}
+    return prior_road_frequencies
+
+
+# When run in a portfolio (Tools/Portfolio Runner.py), the rollouts also close more often the roads
+# of the best closure set of all the optimizers, read before each decision
+SHARED_BEST_WEIGHT = 1.0
+shared_best_roads = set()
+
+
+def rollout_weights(actions):
+    frequencies = road_frequencies()
+    return [preference * (1 + WARM_START_WEIGHT * max(frequencies.get(road, 0.0) for road in action))
+            * (1 + SHARED_BEST_WEIGHT * all(road in shared_best_roads for road in action))
+            for action, preference in zip(actions, unit_preferences(actions, sensitivity_index))]
+
+
+def feasible_adjacent_roads(closed_roads):
+    # Units (roads or streets) to close next, as tuples of roads
+    adjacent = []
+    for road in roads.adjacent_roads(closed_roads):
+        unit = space.unit_of(road)
+        if unit is not None and unit not in adjacent and roads.is_feasible(closed_roads + list(unit)):
+            adjacent.append(unit)
     print("ADJACENT_ROADS =", adjacent)
     return adjacent
 
 
-async def new_closed_roads(closed_roads, adj):
-    new_closed_roads = [{"type": "list<int>", "name": "Closed roads", "value": closed_roads + adj},
-                        {"type": "string", "name": "Id", "value": str(uuid.uuid1())}]
-    print("NEW_ROADS_SET =", new_closed_roads)
-    return new_closed_roads
+# Common random numbers: candidates that are compared with each other are simulated with the same seed
+#   "run": a single seed for the whole exploration, so that every node is compared with its
+#          parent and siblings under the same traffic realization
+#   "none": a new seed for every simulation, chosen by GAMA
+SEEDING_POLICY = "run"
+RUN_SEED = random.randrange(1, 2**31)
 
+# The search tree is kept between decisions and saved after each one: a restarted run goes on
+# from the statistics already simulated, with the seed they were simulated with. A tree saved
+# with other settings (initial closed roads, STREET_GROUPS, NB_STEPS, EVALUATOR) is not loaded.
+# Without RESUME_TREE_SEED (e.g. in the portfolio, where all the optimizers share one seed),
+# RUN_SEED is kept and a tree saved with another seed is not loaded either.
+TREE_FILE = Path(__file__).parent / "mcts_tree.json.gz"
+RESUME_TREE_SEED = True
+# Number of roads (or streets) chosen one after the other, each with iterationLimit more rounds
+NB_DECISIONS = 10
 
-async def kill_GAMA_simulation(client, experiment_id):
-    global stop_future
-    print("killing the GAMA simulation")
-    # Kill the GAMA simulation
-    stop_future = asyncio.get_running_loop().create_future()
-    await client.stop(experiment_id)
-    gama_response = await stop_future
-    if gama_response["type"] != MessageTypes.CommandExecutedSuccessfully.value:
-        print("Unable to stop the experiment", gama_response)
-        return
 
+def simulation_seed():
+    if SEEDING_POLICY == "run":
+        return float(RUN_SEED)
+    return 0.0
 
-async def run_GAMA_simulation(client, experiment_id, closed_roads):
-    # 1 steps = 15 seconds
-    # 4 steps = 1 minute
-    # 240 steps = 1 hr
-    # 5760 steps = 1 day 
-    # 11520 steps = 1 weekend 
-    # 40320 steps = 1 week
-    global expression_future, step_future
-    print("Running the experiment")
-    # Run the GAMA simulation for n + 2 steps (2 blank steps for initialization prob)
-    step_future = asyncio.get_running_loop().create_future()
-    await client.step(experiment_id, 11520 + 2, True)
-    gama_response = await step_future
-    if gama_response["type"] != MessageTypes.CommandExecutedSuccessfully.value:
-        print("Unable to execute the experiment", gama_response)
-        return
-    
-    # screenshoting
-    # dir = str(Path(__file__).parents[0] / "results")
-    # os.makedirs(dir, exist_ok=True)
-    # name = "-".join([str(road) for road in closed_roads]) + ".png"
-    # print("Saving a screenshot to", dir, name)
-    # take_snapshot_command = r"save snapshot('my_display') to:'" + dir.replace('\\', '/') + "/" + name + "';"
-    # expression_future = asyncio.get_running_loop().create_future()
-    # await client.expression(experiment_id, take_snapshot_command)
-    # gama_response = await expression_future
-    # if gama_response["type"] != MessageTypes.CommandExecutedSuccessfully.value:
-    #     print("Unable to save the display", gama_response)
-    #     return
+
+def tree_settings(initial_closed_roads):
+    # Settings the statistics of a saved tree depend on
+    return {"initial_closed_roads": sorted(initial_closed_roads),
+            "street_groups": STREET_GROUPS,
+            "nb_steps": NB_STEPS,
+            "evaluator": EVALUATOR}
 
 
 async def randomPolicy(state):
+    terminal_max_aqi = state.max_aqi
     while not state.isTerminal():
-        try:
-            action = random.choice(await state.getPossibleActions())
-        except IndexError:
-            raise Exception("Non-terminal state has no possible actions: " + str(state))
+        actions = await state.getPossibleActions()
+        # No road can be closed anymore without cutting the network: the rollout ends here
+        if not actions:
+            break
+        action = random.choices(actions, weights = rollout_weights(actions))[0]
         state, terminal_max_aqi = await state.takeAction(action)
 
     return state.getReward(terminal_max_aqi = terminal_max_aqi)
@@ -147,7 +150,7 @@ class treeNode():
 
 
 class MCTS():
-    def __init__(self, client, experiment_id, timeLimit, iterationLimit, explorationConstant,
+    def __init__(self, evaluator, timeLimit, iterationLimit, explorationConstant,
                  rolloutPolicy=randomPolicy):
         if timeLimit != None:
             if iterationLimit != None:
@@ -165,12 +168,14 @@ class MCTS():
             self.limitType = 'iterations'
         self.explorationConstant = explorationConstant
         self.rollout = rolloutPolicy
-        self.client = client
-        self.experiment_id = experiment_id
+        self.evaluator = evaluator
+        self.root = None
 
 
     async def search(self, initialState, root_max_aqi, needDetails=False):
-        self.root = treeNode(initialState, parent = None, max_aqi = root_max_aqi)
+        # The tree of the previous search is reused when it is rooted at the same closure set
+        if self.root is None or sorted(self.root.state.state) != sorted(initialState.state):
+            self.root = treeNode(initialState, parent = None, max_aqi = root_max_aqi)
 
         if self.limitType == 'time':
             timeLimit = time.time() + self.timeLimit / 1000
@@ -180,6 +185,9 @@ class MCTS():
             for _ in range(self.searchLimit):
                 await self.executeRound()
 
+        # No road can be closed from the initial state
+        if not self.root.children:
+            return None
         bestChild = self.getBestChild(self.root, 0)
         action=(action for action, node in self.root.children.items() if node is bestChild).__next__()
         if needDetails:
@@ -208,6 +216,10 @@ class MCTS():
 
     async def expand(self, node):
         actions = await node.state.getPossibleActions()
+        # A dead end: it is not expanded again
+        if not actions:
+            node.isTerminal = node.isFullyExpanded = True
+            return node
         for action in actions:
             if action not in node.children:
                 newState, child_max_aqi = await node.state.takeAction(action)
@@ -220,6 +232,65 @@ class MCTS():
         raise Exception("Should never reach here")
 
 
+    def advance(self, action):
+        '''
+            re-root the tree at the child reached by the chosen action, keeping its subtree
+        '''
+        child = self.root.children.get(action)
+        if child is None:
+            self.root = None
+            return None
+        child.parent = None
+        self.root = child
+        return child.state
+
+
+    def save(self, file, settings):
+        '''
+            save the tree as gzipped JSON with the settings and the seed of its simulations: each
+            node is [action, numVisits, totalReward, max_aqi, isFullyExpanded, children], its closed
+            roads being the ones of its parent plus the action
+        '''
+        def encode(action, node):
+            return [list(action), node.numVisits, node.totalReward, node.max_aqi, node.isFullyExpanded,
+                    [encode(a, child) for a, child in node.children.items()]]
+
+        tree = {"state": self.root.state.state,
+                "root_max_aqi": self.root.state.root_max_aqi,
+                "seed": self.root.state.seed,
+                "settings": settings,
+                "root": encode((), self.root)}
+        with gzip.open(file, "wt") as f:
+            json.dump(tree, f, separators = (",", ":"))
+
+
+    def load(self, file, settings):
+        '''
+            load a tree saved by save(), return its root state, whose seed is the one of the tree,
+            or None when the tree was saved with other settings
+        '''
+        with gzip.open(file, "rt") as f:
+            tree = json.load(f)
+        if tree.get("settings") != settings:
+            print("The search tree in", file, "was saved with other settings:", tree.get("settings"))
+            return None
+        root_max_aqi = tree["root_max_aqi"]
+        seed = tree["seed"]
+
+        def decode(encoded, closed_roads, parent):
+            action, numVisits, totalReward, max_aqi, isFullyExpanded, children = encoded
+            node = treeNode(ClosedRoads(self.evaluator, closed_roads, root_max_aqi, max_aqi, seed), parent, max_aqi)
+            node.numVisits = numVisits
+            node.totalReward = totalReward
+            node.isFullyExpanded = isFullyExpanded
+            for child in children:
+                node.children[tuple(child[0])] = decode(child, closed_roads + child[0], node)
+            return node
+
+        self.root = decode(tree["root"], tree["state"], None)
+        return self.root.state
+
+
     def backpropogate(self, node, reward):
         while node is not None:
             node.numVisits += 1
@@ -242,39 +313,31 @@ class MCTS():
 
 
 class ClosedRoads():
-    def __init__(self, client, experiment_id, initial_closed_roads, root_max_aqi):
+    def __init__(self, evaluator, initial_closed_roads, root_max_aqi, max_aqi = None, seed = 0.0):
         self.state = initial_closed_roads
-        self.client = client
-        self.experiment_id = experiment_id
+        self.evaluator = evaluator
         self.root_max_aqi = root_max_aqi
+        self.max_aqi = max_aqi if max_aqi is not None else root_max_aqi
+        # Seed of the simulations of the tree
+        self.seed = seed
 
 
     async def getPossibleActions(self):
-        possibleActions = await get_adjacent_roads(self.client, self.experiment_id, self.state)
+        possibleActions = feasible_adjacent_roads(self.state)
         return possibleActions
     
     
     async def takeAction(self, action):
-        global reload_future
-        newState = await new_closed_roads(self.state, [action])
-        
-        # Load the GAMA model with the new parameters
-        reload_future = asyncio.get_running_loop().create_future()
-        await self.client.reload(self.experiment_id, newState)
-        res_reload = await reload_future
-        if res_reload["type"] != MessageTypes.CommandExecutedSuccessfully.value:
-            print("Unable to reload the simulation", res_reload)
-            return
-        
-        await run_GAMA_simulation(self.client, self.experiment_id, newState)
-        max_aqi = await get_max_aqi(self.client, self.experiment_id)
+        newState = self.state + list(action)
+        max_aqi = (await self.evaluator.evaluate(newState, self.seed))["max_aqi"]
+        print("MAX_AQI =", max_aqi)
         # return newState as an object, max_aqi
-        return ClosedRoads(self.client, self.experiment_id, newState[0]["value"], self.root_max_aqi), max_aqi
+        return ClosedRoads(self.evaluator, newState, self.root_max_aqi, max_aqi, self.seed), max_aqi
 
 
     def isTerminal(self):
         # Closing max 50 roads
-        if len(self.state) == 50:
+        if len(self.state) >= 50:
             return True
 
 
@@ -282,65 +345,80 @@ class ClosedRoads():
         return self.root_max_aqi - terminal_max_aqi
 
 
-async def main():
-    global experiment_future
+async def mcts_decisions(evaluator, initial_closed_roads, iterationLimit = 1000):
+    '''
+    Choose NB_DECISIONS roads (or streets) to close one after the other from the initial closed roads,
+    keeping the search tree between the decisions and in TREE_FILE
+    '''
+    explorationConstant = 1 / math.sqrt(2)
 
-    # Experiment and Gama-server constants
-    MY_SERVER_URL = "localhost"
-    MY_SERVER_PORT = 6868
-    GAML_FILE_PATH_ON_SERVER = str(Path(__file__).parents[1] / "Hoan Kiem Air Model" / "models" / "HKAM.gaml" ).replace('\\','/')
-    EXPERIMENT_NAME = "exp"
+    searcher = MCTS(evaluator = evaluator,
+                    timeLimit = None, 
+                    iterationLimit = iterationLimit,
+                    explorationConstant = explorationConstant)
+
+    settings = tree_settings(initial_closed_roads)
+    state = searcher.load(TREE_FILE, settings) if TREE_FILE.exists() else None
+    # The statistics are only comparable with new simulations run with the same seed
+    if state is not None and state.seed != simulation_seed() and not RESUME_TREE_SEED:
+        print("The search tree in", TREE_FILE, "was simulated with another seed:", state.seed)
+        state = None
+    if state is not None:
+        root_max_aqi = state.root_max_aqi
+        print("Search tree loaded from", TREE_FILE, "with", searcher.root.numVisits, "visits, seed", state.seed)
+    else:
+        searcher.root = None
+        root_max_aqi = (await evaluator.evaluate(initial_closed_roads, simulation_seed()))["max_aqi"]
+        state = ClosedRoads(evaluator = evaluator,
+                            initial_closed_roads = initial_closed_roads,
+                            root_max_aqi = root_max_aqi,
+                            seed = simulation_seed())
+    print("MAX_AQI =", root_max_aqi)
+
+    global shared_best_roads
+    for decision in range(NB_DECISIONS):
+        if state.isTerminal():
+            break
+        shared_best = await portfolio_best(evaluator, space)
+        if shared_best is not None:
+            shared_best_roads = set(space.to_closed_roads(shared_best[0]))
+        action = await searcher.search(initialState = state, 
+                                       root_max_aqi = root_max_aqi, 
+                                       needDetails = True)
+        if action is None:
+            print("No road left to close")
+            break
+        print("Decision:", decision, "\tBest_closed_roads: ", action)
+
+        # The statistics of the chosen subtree are kept for the next decision
+        state = searcher.advance(action["action"])
+        searcher.save(TREE_FILE, settings)
+
+    print("Closed roads:", state.state)
+    return state.state
 
+
+async def main():
     # Initial parameter
     # Pedestrian area (Phố đi bộ Hồ Hoàn Kiếm)
-    initial_closed_roads = [10, 11, 82, 132, 133, 158, 201, 202, 203, 271, 274, 276, 277, 279, 292, 302, 303, 304, 305, 306, 307, 308, 309, 310, 311, 344, 425, 426, 427, 428, 540, 583, 585, 640]
-    MY_EXP_INIT_PARAMETERS = [{"type": "list<int>", "name": "Closed roads", "value": initial_closed_roads},
-                                {"type": "string", "name": "Id", "value": str(uuid.uuid1())}]
+    initial_closed_roads = list(PHODIBO)
     print("Initial closed roads = ", initial_closed_roads)
 
-    # Connect to the GAMA server
-    client = GamaBaseClient(MY_SERVER_URL, MY_SERVER_PORT, message_handler)
-    await client.connect(ping_interval = None)
-
     # Load the model
     print("Initializing GAMA model")
-    experiment_future = asyncio.get_running_loop().create_future()
-    await client.load(GAML_FILE_PATH_ON_SERVER, EXPERIMENT_NAME, False, False, False, True, MY_EXP_INIT_PARAMETERS)
-    gama_response = await experiment_future
-
-    # Get experiment id of the GAMA simulation in the model
+    evaluator = create_evaluator(EVALUATOR, GAMA_SERVERS, NB_STEPS)
     try:
-        experiment_id = gama_response["content"]
+        await evaluator.start()
     except Exception as e:
-        print("error while initializing", gama_response, e)
+        print("error while initializing", e)
         return
 
     # Start the timer
     start_time = time.time()
 
-    await run_GAMA_simulation(client, experiment_id, initial_closed_roads)
-    root_max_aqi = await get_max_aqi(client, experiment_id)
-
-    initialState = ClosedRoads(client = client, 
-                               experiment_id = experiment_id,
-                               initial_closed_roads = initial_closed_roads,
-                               root_max_aqi = root_max_aqi)
-    
-    explorationConstant = 1 / math.sqrt(2)
-
-    searcher = MCTS(client = client, 
-                    experiment_id = experiment_id, 
-                    timeLimit = None, 
-                    iterationLimit = 1000,
-                    explorationConstant = explorationConstant)
-    
-    action = await searcher.search(initialState = initialState, 
-                                   root_max_aqi = root_max_aqi, 
-                                   needDetails = True)
-
-    print("Best_closed_roads: ", action)
+    await mcts_decisions(evaluator, initial_closed_roads)
 
-    await kill_GAMA_simulation(client, experiment_id)
+    await evaluator.close()
 
     # End the timer
     end_time = time.time()
@@ -0,0 +1,74 @@
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parents[1] / "Common"))
+from gama_pool import NB_STEPS
+from evaluator import CachedEvaluator, GamaEvaluator
+from daemon_client import DAEMON_HOST, DAEMON_PORT, STREAM_LIMIT
+
+
+# Long-lived evaluation daemon: the experiments are loaded once on the gama-servers and kept
+# warm, and any number of optimizer runs share them (and the cache of the results) through
+# the "daemon" evaluation backend (Common/evaluator.py) instead of connecting and loading
+# HKAM.gaml themselves.
+
+# Gama-servers used by the daemon: (url, port, number of experiments kept loaded on the server)
+GAMA_SERVERS = [("localhost", 6868, 4)]
+
+gama: GamaEvaluator
+evaluator: CachedEvaluator
+start_time: float
+
+
+async def handle_request(request):
+    if request["command"] == "evaluate_many":
+        return {"results": await evaluator.evaluate_many(request["closure_sets"], request.get("seeds"))}
+    if request["command"] == "status":
+        return {"slots": len(gama.pool.slots),
+                "free_slots": gama.pool.free_slots.qsize(),
+                "evaluations": sum(slot.nb_evaluations for slot in gama.pool.slots),
+                "recycles": sum(slot.nb_recycles for slot in gama.pool.slots),
+                "cache_hits": evaluator.nb_hits,
+                "nb_steps": gama.pool.nb_steps,
+                "uptime": time.time() - start_time}
+    return {"error": "Unknown command " + str(request["command"])}
+
+
+async def handle_client(reader, writer):
+    try:
+        line = await reader.readline()
+        # Any failure (malformed request, GAMA error, timeout, no slot left) is sent back to the client
+        try:
+            response = await handle_request(json.loads(line))
+        except Exception as e:
+            print("Request failed", repr(e))
+            response = {"error": repr(e)}
+        writer.write(json.dumps(response).encode() + b"\n")
+        await writer.drain()
+    except ConnectionError as e:
+        print("Client disconnected", e)
+    finally:
+        writer.close()
+
+
+async def main():
+    global gama, evaluator, start_time
+
+    start_time = time.time()
+    gama = GamaEvaluator(GAMA_SERVERS, NB_STEPS)
+    evaluator = CachedEvaluator(gama)
+    await evaluator.start()
+
+    server = await asyncio.start_server(handle_client, DAEMON_HOST, DAEMON_PORT, limit = STREAM_LIMIT)
+    print("Evaluation daemon listening on {}:{}".format(DAEMON_HOST, DAEMON_PORT))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await evaluator.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+import asyncio
+import os
+import socket
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parents[1] / "Common"))
+from gama_pool import GamaPool, NB_STEPS
+from job_queue import JOB_QUEUE_FILE, LEASE_DURATION, JobQueue
+
+
+# Evaluation worker: runs the simulations of the job queue (Common/job_queue.py) on the local
+# gama-server, for the optimizers using the "queue" evaluation backend. Start one worker per
+# node with its own gama-server, all on the same queue file: each new node adds its slots.
+
+# Local gama-server: (url, port, number of experiments run concurrently on the server)
+GAMA_SERVERS = [("localhost", 6868, 4)]
+
+# Seconds between two lookups of the queue when it is empty, and between two heartbeats of the running jobs
+POLL_INTERVAL = 1.0
+HEARTBEAT_INTERVAL = LEASE_DURATION / 5
+
+WORKER_ID = "{}:{}".format(socket.gethostname(), os.getpid())
+
+queue: JobQueue
+pool: GamaPool
+running = {}
+
+
+async def run_job(id, closed_roads, seed, nb_steps):
+    try:
+        metrics = await pool.evaluate(closed_roads, seed, nb_steps)
+    except Exception as e:
+        print("Job", id, "failed:", repr(e))
+        queue.fail(WORKER_ID, id, repr(e))
+    else:
+        queue.complete(id, metrics)
+    finally:
+        del running[id]
+
+
+async def heartbeats():
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        queue.heartbeat(WORKER_ID, list(running))
+
+
+async def main():
+    global queue, pool
+
+    queue = JobQueue(JOB_QUEUE_FILE)
+    pool = GamaPool(GAMA_SERVERS, NB_STEPS)
+    await pool.start()
+    print("Worker", WORKER_ID, "serving", JOB_QUEUE_FILE)
+
+    heartbeat_task = asyncio.ensure_future(heartbeats())
+    nb_jobs = 0
+    start_time = time.time()
+    try:
+        while True:
+            # As many jobs as free slots are leased, so that the other workers get the rest
+            free = len(pool.slots) - len(running)
+            jobs = queue.lease(WORKER_ID, free) if free > 0 else []
+            for id, closed_roads, seed, nb_steps in jobs:
+                running[id] = asyncio.ensure_future(run_job(id, closed_roads, seed, nb_steps))
+            nb_jobs += len(jobs)
+            if not jobs:
+                await asyncio.sleep(POLL_INTERVAL)
+                if nb_jobs and not running:
+                    print(nb_jobs, "jobs in", time.time() - start_time, "seconds, queue:", queue.status())
+                    nb_jobs = 0
+                    start_time = time.time()
+    finally:
+        heartbeat_task.cancel()
+        # The jobs of a stopped worker go back to the queue at once instead of when their lease expires
+        queue.release(WORKER_ID, list(running))
+        for task in list(running.values()):
+            task.cancel()
+        await pool.close()
+        queue.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,277 @@
+import asyncio
+import importlib.util
+import itertools
+import json
+import math
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parents[1] / "Common"))
+from evaluator import Evaluator, create_evaluator
+
+
+# Hyperparameter sweep: every trial is one run of an optimizer script with its own settings
+# (module constants such as N, c1, c2, w_start and w_end of the PSO). All the trials run at
+# once on a single evaluator, so they share its pool of slots and its result cache, and they
+# simulate with the same seeds so that their max AQIs are comparable. Poor trials are stopped
+# early by successive halving: when all the running trials have spent MIN_EVALUATIONS, ETA**1
+# * MIN_EVALUATIONS, ... simulations, only the best 1/ETA of them go on. Each trial stops at
+# MAX_TRIAL_EVALUATIONS. The best max AQI of each trial after each of its batches (quality
+# versus evaluations) is saved to SWEEP_RESULTS_FILE.
+
+# Evaluation backend: "gama", "daemon", "queue" or "synthetic"
+EVALUATOR = "gama"
+
+# List of gama-servers: (url, port, number of experiments run concurrently on the server)
+GAMA_SERVERS = [("localhost", 6868, 8), ("localhost", 6869, 8)]
+
+# 1 steps = 15 seconds, 48*12 steps = 2.4 hours
+SWEEP_NB_STEPS = 48*12
+
+ROOT_DIR = Path(__file__).parents[1]
+
+# Optimizer to tune: "pso", "ga" or "bo"
+OPTIMIZER = "pso"
+SCRIPTS = {"pso": ROOT_DIR / "Optimaztion Algorithms" / "Parallel Particle Swarm Optimization.py",
+           "ga": ROOT_DIR / "Optimaztion Algorithms" / "Genetic Algorithms.py",
+           "bo": ROOT_DIR / "Optimaztion Algorithms" / "Bayesian Optimization.py"}
+
+# Settings of the script given to every trial. The trials are stopped by their evaluation
+# budget, so the number of iterations of the optimizer is only an upper bound.
+FIXED_SETTINGS = {"max_iter": 1000}
+
+# "grid": every combination of the values of GRID
+# "random": NB_RANDOM_TRIALS draws in RANDOM_SPACE, where a (low, high) pair of ints is drawn
+# as an int, a pair of floats as a float, and a list as one of its values
+SWEEP_MODE = "grid"
+GRID = {"N": [5, 7, 10, 15],
+        "c1": [1, 2],
+        "c2": [1, 2],
+        "w_end": [0.2, 0.4]}
+RANDOM_SPACE = {"N": (5, 15),
+                "c1": (0.5, 2.5),
+                "c2": (0.5, 2.5),
+                "w_start": (0.6, 1.0),
+                "w_end": (0.1, 0.5)}
+NB_RANDOM_TRIALS = 16
+
+# Successive halving
+MIN_EVALUATIONS = 50
+ETA = 2
+MAX_TRIAL_EVALUATIONS = 800
+
+# All the trials simulate with the same seeds (common random numbers)
+RUN_SEED = random.randrange(1, 2**31)
+
+SWEEP_RESULTS_FILE = Path(__file__).parent / "hyperparameter_sweep.json"
+
+
+class TrialStopped(Exception):
+    '''
+    Raised to the optimizer of a trial stopped by the successive halving or by its budget
+    '''
+
+
+class Trial(Evaluator):
+    '''
+    Evaluator given to the optimizer of one trial: it counts the simulations of the trial,
+    records its best max AQI, and stops it at the checkpoints of the sweep
+    '''
+    def __init__(self, sweep: "Sweep", index, settings):
+        self.sweep = sweep
+        self.index = index
+        self.settings = settings
+        self.status = "running"
+        self.rung = 0
+        self.nb_evaluations = 0
+        self.best_max_aqi = float("inf")
+        # (number of simulations, best max AQI) after each batch of the trial
+        self.curve = []
+
+    async def evaluate_many(self, closure_sets, seeds = None):
+        await self.sweep.checkpoint(self)
+        results = await self.sweep.evaluator.evaluate_many(closure_sets, seeds)
+        self.nb_evaluations += len(results)
+        self.best_max_aqi = min([self.best_max_aqi] + [metrics["max_aqi"] for metrics in results])
+        self.curve.append((self.nb_evaluations, self.best_max_aqi))
+        self.sweep.record(self, len(results))
+        return results
+
+
+class Sweep:
+    '''
+    Trials sharing one evaluator, with synchronous successive halving: a trial reaching the
+    budget of a rung waits until every running trial has reached it, then only the best
+    1/ETA of them (at least one) are promoted to the next rung
+    '''
+    def __init__(self, evaluator: Evaluator, settings, min_evaluations = MIN_EVALUATIONS, eta = ETA,
+                 max_trial_evaluations = MAX_TRIAL_EVALUATIONS):
+        self.evaluator = evaluator
+        self.trials = [Trial(self, index, trial_settings) for index, trial_settings in enumerate(settings)]
+        self.max_trial_evaluations = max_trial_evaluations
+        self.eta = eta
+        self.rungs = []
+        budget = min_evaluations
+        while budget < max_trial_evaluations:
+            self.rungs.append(budget)
+            budget *= eta
+        # Trials waiting at each rung, and the event set once the rung is decided
+        self.reports = [set() for _ in self.rungs]
+        self.decisions = [asyncio.Event() for _ in self.rungs]
+        self.promoted = [set() for _ in self.rungs]
+        self.nb_evaluations = 0
+        # (simulations of all the trials, best max AQI of the sweep)
+        self.curve = []
+        self.best_max_aqi = float("inf")
+
+    def running(self):
+        return [trial for trial in self.trials if trial.status == "running"]
+
+    async def checkpoint(self, trial: Trial):
+        if trial.status != "running":
+            raise TrialStopped()
+        if trial.nb_evaluations >= self.max_trial_evaluations:
+            trial.status = "completed"
+            self.decide()
+            raise TrialStopped()
+        while trial.rung < len(self.rungs) and trial.nb_evaluations >= self.rungs[trial.rung]:
+            rung = trial.rung
+            self.reports[rung].add(trial)
+            self.decide()
+            await self.decisions[rung].wait()
+            if trial not in self.promoted[rung]:
+                trial.status = "stopped at {} evaluations".format(self.rungs[rung])
+                raise TrialStopped()
+            trial.rung += 1
+
+    def decide(self):
+        # A rung is decided once all the running trials wait at it
+        for rung in range(len(self.rungs)):
+            if self.decisions[rung].is_set():
+                continue
+            running = self.running()
+            if not running or not all(trial in self.reports[rung] for trial in running):
+                return
+            ranking = sorted(running, key = lambda trial: trial.best_max_aqi)
+            self.promoted[rung] = set(ranking[:max(1, math.ceil(len(ranking) / self.eta))])
+            print("Rung", rung, "(", self.rungs[rung], "evaluations):", len(self.promoted[rung]), "of", len(ranking),
+                  "trials promoted, best max AQI", ranking[0].best_max_aqi)
+            self.decisions[rung].set()
+            return
+
+    def finish(self, trial: Trial, error = None):
+        # The optimizer of the trial returned or failed: it no longer holds back the other trials
+        if trial.status == "running":
+            trial.status = "failed: " + repr(error) if error is not None else "finished"
+        self.decide()
+
+    def record(self, trial: Trial, nb_evaluations):
+        self.nb_evaluations += nb_evaluations
+        if trial.best_max_aqi < self.best_max_aqi:
+            self.best_max_aqi = trial.best_max_aqi
+            print("Sweep best found by trial", trial.index, trial.settings, ":", self.best_max_aqi)
+        self.curve.append((self.nb_evaluations, self.best_max_aqi))
+
+
+def sweep_settings():
+    if SWEEP_MODE == "grid":
+        return [dict(zip(GRID, values)) for values in itertools.product(*GRID.values())]
+    if SWEEP_MODE == "random":
+        return [{name: draw(values) for name, values in RANDOM_SPACE.items()} for _ in range(NB_RANDOM_TRIALS)]
+    raise ValueError("Unknown sweep mode: " + str(SWEEP_MODE))
+
+
+def draw(values):
+    if isinstance(values, list):
+        return random.choice(values)
+    low, high = values
+    if isinstance(low, int) and isinstance(high, int):
+        return random.randint(low, high)
+    return random.uniform(low, high)
+
+
+def load_trial(trial: Trial):
+    spec = importlib.util.spec_from_file_location("{}_trial_{}".format(OPTIMIZER, trial.index), SCRIPTS[OPTIMIZER])
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.RUN_SEED = RUN_SEED
+    module.NB_STEPS = SWEEP_NB_STEPS
+    for setting, value in {**FIXED_SETTINGS, **trial.settings}.items():
+        setattr(module, setting, value)
+    module.evaluator = trial
+    return module
+
+
+async def run_trial(sweep: Sweep, trial: Trial, module):
+    try:
+        if OPTIMIZER == "pso":
+            await module.pso_optimization()
+        elif OPTIMIZER == "ga":
+            await module.evolve(module.POPULATION_SIZE)
+        elif OPTIMIZER == "bo":
+            await module.bayesian_optimization()
+        else:
+            raise ValueError("Unknown optimizer: " + str(OPTIMIZER))
+    except TrialStopped:
+        pass
+    except Exception as e:
+        print("Trial", trial.index, "failed:", repr(e))
+        sweep.finish(trial, e)
+        return
+    sweep.finish(trial)
+
+
+async def main():
+    settings = sweep_settings()
+    print("Sweep of", OPTIMIZER, "with", len(settings), "trials")
+
+    # Load the model
+    print("initialize all gaml models")
+    evaluator = create_evaluator(EVALUATOR, GAMA_SERVERS, SWEEP_NB_STEPS)
+    try:
+        await evaluator.start()
+    except Exception as e:
+        print("error while initializing", e)
+        return
+
+    # Start the timer
+    start_time = time.time()
+
+    sweep = Sweep(evaluator, settings)
+    modules = [load_trial(trial) for trial in sweep.trials]
+    await asyncio.gather(*[run_trial(sweep, trial, module) for trial, module in zip(sweep.trials, modules)])
+
+    await evaluator.close()
+
+    print("Trial, settings, evaluations, best max AQI, status:")
+    for trial in sorted(sweep.trials, key = lambda trial: trial.best_max_aqi):
+        print(trial.index, trial.settings, trial.nb_evaluations, trial.best_max_aqi, trial.status)
+    print("Simulations requested:", sweep.nb_evaluations,
+          "instead of", len(sweep.trials) * MAX_TRIAL_EVALUATIONS, "without early stopping")
+    if hasattr(evaluator, "nb_hits"):
+        print("Answered by the cache:", evaluator.nb_hits)
+
+    results = {"optimizer": OPTIMIZER,
+               "nb_steps": SWEEP_NB_STEPS,
+               "seed": RUN_SEED,
+               "rungs": sweep.rungs,
+               "eta": ETA,
+               "trials": [{"settings": trial.settings,
+                           "status": trial.status,
+                           "nb_evaluations": trial.nb_evaluations,
+                           "best_max_aqi": trial.best_max_aqi,
+                           "curve": trial.curve} for trial in sweep.trials],
+               "curve": sweep.curve}
+    with open(SWEEP_RESULTS_FILE, "w") as f:
+        json.dump(results, f, indent = 1)
+    print("Sweep results saved to", SWEEP_RESULTS_FILE)
+
+    # End the timer
+    end_time = time.time()
+    total_time = end_time - start_time
+    print("Total time:", total_time, "seconds")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+import asyncio
+import importlib.util
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parents[1] / "Common"))
+from evaluator import create_evaluator
+from gama_pool import NB_STEPS
+from portfolio import BudgetExhausted, Portfolio
+from search_space import PHODIBO
+
+
+# Portfolio runner: several optimizers run in one process as asyncio tasks on a single evaluator
+# (one pool of gama-server slots and one result cache, see Common/portfolio.py). The slots go to
+# whichever optimizer improved the max AQI the fastest lately, and each optimizer picks up the
+# best closure set found by the others.
+
+# Evaluation backend: "gama", "daemon", "queue" or "synthetic"
+EVALUATOR = "gama"
+
+# List of gama-servers: (url, port, number of experiments run concurrently on the server)
+GAMA_SERVERS = [("localhost", 6868, 4), ("localhost", 6869, 4)]
+
+# Simulation length shared by all the optimizers, their results are only comparable that way
+PORTFOLIO_NB_STEPS = NB_STEPS
+
+# Number of simulations of the whole portfolio (None: until every optimizer has finished)
+BUDGET = 2000
+
+# All the optimizers simulate with the same seed, so that their max AQIs are comparable
+RUN_SEED = random.randrange(1, 2**31)
+
+ROOT_DIR = Path(__file__).parents[1]
+
+# Optimizers of the portfolio: name -> (script, settings of the script overridden for the portfolio)
+OPTIMIZERS = {"pso": (ROOT_DIR / "Optimaztion Algorithms" / "Parallel Particle Swarm Optimization.py", {"N": 7, "max_iter": 250}),
+              "ga": (ROOT_DIR / "Optimaztion Algorithms" / "Genetic Algorithms.py", {"POPULATION_SIZE": 100}),
+              "bo": (ROOT_DIR / "Optimaztion Algorithms" / "Bayesian Optimization.py", {"MAX_EVALUATIONS": 400}),
+              "greedy": (ROOT_DIR / "Recursive Algorithms" / "Greedy Exploration.py", {}),
+              "mcts": (ROOT_DIR / "Recursive Algorithms" / "Monte Carlo Tree Search.py",
+                       {"TREE_FILE": Path(__file__).parent / "portfolio_mcts_tree.json.gz", "RESUME_TREE_SEED": False})}
+
+
+def load_optimizer(name, script, settings):
+    spec = importlib.util.spec_from_file_location(name, script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.EVALUATOR = EVALUATOR
+    module.SEEDING_POLICY = "run"
+    module.RUN_SEED = RUN_SEED
+    module.NB_STEPS = PORTFOLIO_NB_STEPS
+    for setting, value in settings.items():
+        setattr(module, setting, value)
+    return module
+
+
+async def run_optimizer(name, module, member):
+    module.evaluator = member
+    if name == "pso":
+        await module.pso_optimization()
+    elif name == "ga":
+        await module.evolve(module.POPULATION_SIZE)
+    elif name == "bo":
+        await module.bayesian_optimization()
+    elif name == "greedy":
+        root = module.Node(list(PHODIBO))
+        await module.greedy_exploration(member, root, root)
+    elif name == "mcts":
+        await module.mcts_decisions(member, list(PHODIBO))
+    else:
+        raise ValueError("Unknown optimizer: " + str(name))
+
+
+async def main():
+    modules = {name: load_optimizer(name, script, settings) for name, (script, settings) in OPTIMIZERS.items()}
+
+    # Load the model
+    print("initialize all gaml models")
+    evaluator = create_evaluator(EVALUATOR, GAMA_SERVERS, PORTFOLIO_NB_STEPS)
+    try:
+        await evaluator.start()
+    except Exception as e:
+        print("error while initializing", e)
+        return
+
+    # Start the timer
+    start_time = time.time()
+
+    portfolio = Portfolio(evaluator, sum(nb_slots for url, port, nb_slots in GAMA_SERVERS), BUDGET, float(RUN_SEED))
+    members = {name: portfolio.member(name) for name in modules}
+    results = await asyncio.gather(*[run_optimizer(name, modules[name], members[name]) for name in modules],
+                                   return_exceptions = True)
+    for name, result in zip(modules, results):
+        if isinstance(result, BudgetExhausted):
+            print(name, "stopped: budget of", BUDGET, "simulations spent")
+        elif isinstance(result, BaseException):
+            print(name, "failed:", repr(result))
+
+    await evaluator.close()
+
+    print("Optimizer, evaluations, best max AQI, final weight:")
+    for name, (nb_evaluations, best_max_aqi, weight) in portfolio.summary().items():
+        print(name, nb_evaluations, best_max_aqi, weight)
+    print("Best closed roads:", portfolio.best_closed_roads)
+    print("Best max AQI:", portfolio.best_max_aqi)
+
+    # End the timer
+    end_time = time.time()
+    total_time = end_time - start_time
+    print("Total time:", total_time, "seconds")
+
+if __name__ == "__main__":
+    asyncio.run(main())
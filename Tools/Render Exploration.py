@@ -0,0 +1,68 @@
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parents[1] / "Common"))
+from exploration_log import last_exploration_file, read_exploration
+
+
+# Renders the exploration tree written by Recursive Algorithms/Greedy Exploration.py (Common/exploration_log.py),
+# while the exploration runs or after it. The file can be given on the command line, by default
+# the last exploration is rendered:
+#   python "Tools/Render Exploration.py" ["Recursive Algorithms/exploration/<date>.jsonl"]
+# igraph and matplotlib are only needed here, not by the explorations.
+
+# Save the figure as a png next to the event stream instead of showing it
+SAVE_TO_FILE = False
+
+
+def render(events, save_to):
+    import igraph as ig
+    import matplotlib.pyplot as plt
+
+    nodes = [event for event in events if event["event"] == "node"]
+    current = [event["id"] for event in events if event["event"] == "current"]
+    root_id = nodes[0]["id"] if nodes else None
+    current_id = current[-1] if current else None
+
+    graph = ig.Graph(directed = True)
+    graph.add_vertices(len(nodes))
+    index_of = {node["id"]: i for i, node in enumerate(nodes)}
+    graph.add_edges([(index_of[node["parent"]], i) for i, node in enumerate(nodes) if node["parent"] in index_of])
+
+    fig, ax = plt.subplots()
+    ig.plot(
+        graph,
+        target=ax,
+        layout="kk",
+        vertex_size=0.5,
+        vertex_color=["green" if node["id"] == root_id else "red" if node["id"] == current_id else "steelblue" for node in nodes],
+        vertex_frame_width=4.0,
+        vertex_frame_color="white",
+        vertex_label=[str(node["closed_roads"][-1]) for node in nodes],
+        vertex_label_size=10.0,
+    )
+    if save_to is not None:
+        plt.savefig(save_to)
+        print("Exploration saved to", save_to)
+    else:
+        plt.show()
+
+
+def main():
+    file = Path(sys.argv[1]) if len(sys.argv) > 1 else last_exploration_file()
+    if file is None:
+        print("No exploration to render")
+        return
+    events = read_exploration(file)
+    nodes = [event for event in events if event["event"] == "node"]
+    print(len(nodes), "nodes in", file)
+    if nodes:
+        best = min(nodes, key = lambda node: node["max_aqi"])
+        print("Best closed roads:", best["closed_roads"])
+        print("Best max AQI:", best["max_aqi"])
+
+    save_to = file.with_suffix(".png") if SAVE_TO_FILE else None
+    render(events, save_to)
+
+if __name__ == "__main__":
+    main()
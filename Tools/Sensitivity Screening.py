@@ -0,0 +1,67 @@
+import asyncio
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parents[1] / "Common"))
+from evaluator import create_evaluator
+from gama_pool import NB_STEPS
+from road_graph import get_road_graph
+from search_space import PHODIBO, SearchSpace
+from sensitivity import SENSITIVITY_INDEX_FILE
+
+
+# One-time screening: the pedestrian area plus each free road is simulated under NB_SEEDS seeds,
+# and the marginal effect of the road is its mean max AQI minus the one of the pedestrian area
+# alone under the same seeds. The optimizers read the result (Common/sensitivity.py) as a prior.
+
+# Evaluation backend (see Common/evaluator.py): "gama", "daemon", "queue" or "synthetic"
+EVALUATOR = "gama"
+# Gama-servers used by the "gama" backend: (url, port, number of experiments run concurrently on the server)
+GAMA_SERVERS = [("localhost", 6868, 8)]
+
+NB_SEEDS = 3
+
+
+async def main():
+    roads = get_road_graph()
+    space = SearchSpace(PHODIBO)
+    seeds = [float(random.randrange(1, 2**31)) for _ in range(NB_SEEDS)]
+
+    # Roads whose closure alone would disconnect the network are not simulated
+    screened_roads = [road for road in space.free_roads if roads.is_feasible(PHODIBO + [road])]
+    print("Screening", len(screened_roads), "roads with", NB_SEEDS, "seeds")
+
+    evaluator = create_evaluator(EVALUATOR, GAMA_SERVERS)
+    await evaluator.start()
+
+    start_time = time.time()
+    closure_sets = [PHODIBO] + [PHODIBO + [road] for road in screened_roads]
+    results = await evaluator.evaluate_many([closed_roads for closed_roads in closure_sets for _ in seeds],
+                                            [seed for _ in closure_sets for seed in seeds])
+    max_aqis = [[metrics["max_aqi"] for metrics in results[i * NB_SEEDS:(i + 1) * NB_SEEDS]]
+                for i in range(len(closure_sets))]
+    await evaluator.close()
+
+    baseline = max_aqis[0]
+    effects = {road: None for road in space.free_roads}
+    for road, road_max_aqis in zip(screened_roads, max_aqis[1:]):
+        effects[road] = sum(a - b for a, b in zip(road_max_aqis, baseline)) / NB_SEEDS
+
+    index = {"baseline": PHODIBO,
+             "baseline_max_aqi": sum(baseline) / NB_SEEDS,
+             "seeds": seeds,
+             "nb_steps": NB_STEPS,
+             "effects": effects}
+    with open(SENSITIVITY_INDEX_FILE, "w") as f:
+        json.dump(index, f, indent = 1)
+    print("Sensitivity index saved to", SENSITIVITY_INDEX_FILE)
+
+    ranking = sorted((effect, road) for road, effect in effects.items() if effect is not None)
+    print("Roads lowering the max AQI the most:", [(road, effect) for effect, road in ranking[:20]])
+    print("Total time:", time.time() - start_time, "seconds")
+
+if __name__ == "__main__":
+    asyncio.run(main())
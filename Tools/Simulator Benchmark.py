@@ -0,0 +1,178 @@
+import asyncio
+import json
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parents[1] / "Common"))
+from gama_pool import GamaCommandError, GamaConnection, MEMORY_EXPRESSION, NB_STEPS, RUN_METRICS
+from road_graph import ROAD_CANT_CLOSE
+from search_space import NB_ROADS, PHODIBO_2023
+
+
+# Performance benchmark of HKAM.gaml on the scenarios of its batch experiments, run headless
+# through gama-server with the "optimize" experiment. For each scenario it records the
+# simulated cycles per second, the latency of the reload, time_vehicles_move and
+# nb_recompute_path (see run_metrics() in HKAM.gaml) and the peak memory of the server,
+# and compares them with the stored baseline: a slower model shows up before it slows down
+# the optimization runs. The baseline is written by the first run, or with UPDATE_BASELINE.
+# The max AQI of each scenario must also be the same as in the baseline: a change of the
+# model meant as a pure speed-up must not change what the optimizers minimise.
+
+GAMA_SERVER = ("localhost", 6868)
+
+BASELINE_FILE = Path(__file__).parent / "simulator_benchmark_baseline.json"
+UPDATE_BASELINE = False
+
+# Same length as the simulations of the optimizers
+BENCHMARK_STEPS = NB_STEPS
+# The memory of the server is sampled every MEMORY_SAMPLING_STEPS steps
+MEMORY_SAMPLING_STEPS = 1440
+
+# Each scenario is run NB_REPEATS times with the same seed, the median of each measure is kept
+NB_REPEATS = 1
+BENCHMARK_SEED = 1.0
+
+# Relative change beyond which a measure is reported as a regression
+TOLERANCE = 0.1
+
+# Scenarios of the batch experiments of HKAM.gaml: (name, closed roads, motorbikes, cars)
+EVERYTHING_CLOSED = [road for road in range(NB_ROADS) if road not in ROAD_CANT_CLOSE]
+SCENARIOS = [("nothing_closed - 660 - 100", [], 660, 100),
+             ("nothing_closed - 1500 - 500", [], 1500, 500),
+             ("current_pedestrian_closed - 660 - 100", PHODIBO_2023, 660, 100),
+             ("current_pedestrian_closed - 1500 - 500", PHODIBO_2023, 1500, 500),
+             ("everything_closed - 660 - 100", EVERYTHING_CLOSED, 660, 100),
+             ("everything_closed - 1500 - 500", EVERYTHING_CLOSED, 1500, 500)]
+
+# Measures compared with the baseline, and whether a higher value is better
+MEASURES = {"cycles_per_second": True,
+            "reload_latency": False,
+            "time_vehicles_move": False,
+            "nb_recompute_path": False,
+            "peak_memory": False}
+
+# Outputs of the model that must not change (same seed and number of steps as the baseline)
+OUTPUTS = ["max_aqi"]
+
+
+async def memory_used(connection, experiment_id):
+    try:
+        return float(await connection.expression(experiment_id, MEMORY_EXPRESSION))
+    except (GamaCommandError, ValueError) as e:
+        print("Unable to read the memory of the server:", e)
+        return None
+
+
+async def run_scenario(connection, experiment_id, closed_roads, nb_motorbikes, nb_cars):
+    parameters = [{"type": "list<int>", "name": "Closed roads", "value": closed_roads},
+                  {"type": "int", "name": "Number of motorbikes", "value": nb_motorbikes},
+                  {"type": "int", "name": "Number of cars", "value": nb_cars},
+                  {"type": "string", "name": "Id", "value": str(uuid.uuid1())},
+                  {"type": "float", "name": "Seed", "value": BENCHMARK_SEED}]
+    start = time.time()
+    await connection.reload(experiment_id, parameters)
+    reload_latency = time.time() - start
+
+    memory = [await memory_used(connection, experiment_id)]
+    step_time = 0.0
+    nb_steps = 0
+    while nb_steps < BENCHMARK_STEPS:
+        steps = min(MEMORY_SAMPLING_STEPS, BENCHMARK_STEPS - nb_steps)
+        start = time.time()
+        await connection.step(experiment_id, steps)
+        step_time += time.time() - start
+        nb_steps += steps
+        memory.append(await memory_used(connection, experiment_id))
+
+    metrics = dict(zip(RUN_METRICS, json.loads(await connection.expression(experiment_id, r"run_metrics()"))))
+    memory = [m for m in memory if m is not None]
+    return {"cycles_per_second": nb_steps / step_time,
+            "reload_latency": reload_latency,
+            "time_vehicles_move": metrics["time_vehicles_move"],
+            "nb_recompute_path": metrics["nb_recompute_path"],
+            "peak_memory": max(memory) if memory else None,
+            "max_aqi": metrics["max_aqi"]}
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2] if len(values) % 2 else (values[len(values) // 2 - 1] + values[len(values) // 2]) / 2
+
+
+def regressions(results, baseline):
+    found = []
+    for name, measures in results.items():
+        if name not in baseline["scenarios"]:
+            continue
+        for measure, higher_is_better in MEASURES.items():
+            value, reference = measures[measure], baseline["scenarios"][name][measure]
+            if value is None or not reference:
+                continue
+            change = (value - reference) / reference
+            if (-change if higher_is_better else change) > TOLERANCE:
+                found.append((name, measure, reference, value, change))
+    return found
+
+
+def output_changes(results, baseline):
+    changed = []
+    for name, measures in results.items():
+        if name not in baseline["scenarios"]:
+            continue
+        for output in OUTPUTS:
+            value, reference = measures[output], baseline["scenarios"][name].get(output)
+            if reference is not None and value != reference:
+                changed.append((name, output, reference, value))
+    return changed
+
+
+async def main():
+    connection = GamaConnection(*GAMA_SERVER)
+    await connection.connect()
+    start = time.time()
+    experiment_id = await connection.load()
+    load_latency = time.time() - start
+    print("Experiment loaded in", load_latency, "seconds")
+
+    results = {}
+    try:
+        for name, closed_roads, nb_motorbikes, nb_cars in SCENARIOS:
+            runs = [await run_scenario(connection, experiment_id, closed_roads, nb_motorbikes, nb_cars)
+                    for _ in range(NB_REPEATS)]
+            results[name] = {measure: median([run[measure] for run in runs])
+                             if all(run[measure] is not None for run in runs) else None
+                             for measure in runs[0]}
+            print(name, results[name])
+    finally:
+        await connection.stop(experiment_id)
+        await connection.close()
+
+    benchmark = {"nb_steps": BENCHMARK_STEPS, "seed": BENCHMARK_SEED, "load_latency": load_latency,
+                 "date": time.strftime("%Y-%m-%d %H:%M:%S"), "scenarios": results}
+
+    if UPDATE_BASELINE or not BASELINE_FILE.exists():
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(benchmark, f, indent = 1)
+        print("Baseline saved to", BASELINE_FILE)
+        return
+
+    with open(BASELINE_FILE) as f:
+        baseline = json.load(f)
+    if baseline["nb_steps"] != BENCHMARK_STEPS or baseline["seed"] != BENCHMARK_SEED:
+        print("The baseline was run with {} steps and seed {}, not comparable".format(baseline["nb_steps"], baseline["seed"]))
+        sys.exit(2)
+
+    found = regressions(results, baseline)
+    for name, measure, reference, value, change in found:
+        print("REGRESSION {}: {} {} -> {} ({:+.1%})".format(name, measure, reference, value, change))
+    changed = output_changes(results, baseline)
+    for name, output, reference, value in changed:
+        print("OUTPUT CHANGED {}: {} {} -> {}".format(name, output, reference, value))
+    if found or changed:
+        sys.exit(1)
+    print("No regression against the baseline of", baseline["date"])
+
+if __name__ == "__main__":
+    asyncio.run(main())
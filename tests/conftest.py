@@ -0,0 +1,19 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).parents[1]
+sys.path.append(str(ROOT_DIR / "Common"))
+
+
+@pytest.fixture
+def load_script():
+    # The scripts have spaces in their names: they are loaded from their path instead of imported
+    def load(relative_path, name = None):
+        spec = importlib.util.spec_from_file_location(name or Path(relative_path).stem.replace(" ", "_"), ROOT_DIR / relative_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    return load
@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+import pytest
+
+from evaluator import Evaluator
+
+
+class FakeEvaluator(Evaluator):
+    async def evaluate_many(self, closure_sets, seeds = None):
+        return [{"max_aqi": float(len(closed_roads))} for closed_roads in closure_sets]
+
+
+class BrokenPool(Evaluator):
+    async def evaluate_many(self, closure_sets, seeds = None):
+        raise RuntimeError("No GAMA experiment left in the pool")
+
+
+async def request(port, line):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(line)
+    await writer.drain()
+    response = await reader.readline()
+    writer.close()
+    return json.loads(response)
+
+
+def test_evaluate_many(load_script):
+    daemon = load_script("Tools/Evaluation Daemon.py")
+    daemon.evaluator = FakeEvaluator()
+
+    async def run():
+        server = await asyncio.start_server(daemon.handle_client, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            response = await request(port, b'{"command": "evaluate_many", "closure_sets": [[1, 2], []]}\n')
+        finally:
+            server.close()
+        assert response == {"results": [{"max_aqi": 2.0}, {"max_aqi": 0.0}]}
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("line, error", [(b"not json\n", "JSONDecodeError"),
+                                         (b'{"closure_sets": [[1]]}\n', "KeyError"),
+                                         (b'{"command": "evaluate_many", "closure_sets": [[1]]}\n', "No GAMA experiment left"),
+                                         (b'{"command": "unknown"}\n', "Unknown command")])
+def test_failed_requests_get_an_error(load_script, line, error):
+    daemon = load_script("Tools/Evaluation Daemon.py")
+    daemon.evaluator = BrokenPool()
+
+    async def run():
+        server = await asyncio.start_server(daemon.handle_client, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            response = await request(port, line)
+        finally:
+            server.close()
+        assert error in response["error"]
+    asyncio.run(run())
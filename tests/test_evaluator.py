@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from evaluator import CachedEvaluator, Evaluator, SyntheticEvaluator
+
+
+class CountingEvaluator(Evaluator):
+    def __init__(self, error = None):
+        self.calls = []
+        self.error = error
+
+    async def evaluate_many(self, closure_sets, seeds = None):
+        self.calls.append(list(zip(closure_sets, seeds)))
+        await asyncio.sleep(0.01)
+        if self.error is not None:
+            raise self.error
+        return [{"max_aqi": float(sum(closed_roads) + seed)} for closed_roads, seed in zip(closure_sets, seeds)]
+
+
+def test_cache_deduplicates():
+    async def run():
+        counting = CountingEvaluator()
+        cached = CachedEvaluator(counting)
+        # The same candidate twice in a batch, in another order, and in a concurrent batch
+        first, second = await asyncio.gather(cached.evaluate_many([[1, 2], [2, 1], [3]], [0.0, 0.0, 0.0]),
+                                             cached.evaluate_many([[3], [1, 2]], [0.0, 0.0]))
+        assert [metrics["max_aqi"] for metrics in first] == [3.0, 3.0, 3.0]
+        assert [metrics["max_aqi"] for metrics in second] == [3.0, 3.0]
+        assert sum(len(call) for call in counting.calls) == 2
+        assert cached.nb_hits == 3
+
+        # Known candidates are not evaluated again, another seed is another candidate
+        await cached.evaluate_many([[1, 2], [1, 2]], [0.0, 1.0])
+        assert counting.calls[-1] == [([1, 2], 1.0)]
+        assert sum(len(call) for call in counting.calls) == 3
+    asyncio.run(run())
+
+
+def test_cache_propagates_errors():
+    async def run():
+        cached = CachedEvaluator(CountingEvaluator(RuntimeError("simulation failed")))
+        results = await asyncio.gather(cached.evaluate_many([[1]], [0.0]), cached.evaluate_many([[1]], [0.0]),
+                                       return_exceptions = True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        # A failed candidate is not cached
+        assert cached.cache == {} and cached.pending == {}
+    asyncio.run(run())
+
+
+def test_synthetic_evaluator_is_deterministic():
+    async def run():
+        evaluator = SyntheticEvaluator()
+        first = await evaluator.evaluate_many([[1, 2, 3], [4]], [5.0, 5.0])
+        second = await SyntheticEvaluator().evaluate_many([[3, 2, 1], [4]], [5.0, 6.0])
+        assert first[0]["max_aqi"] == second[0]["max_aqi"]
+        assert first[1]["max_aqi"] != second[1]["max_aqi"]
+    asyncio.run(run())
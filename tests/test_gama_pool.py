@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+from gama_pool import HEDGING_MIN_RUNS, MEMORY_CHECK_INTERVAL, STEP_TIME_WINDOW, GamaPool, GamaSlot
+
+
+class FakeSlot:
+    '''
+    Slot whose simulations and reloads fail when its server is down
+    '''
+    def __init__(self, name, down = False, can_recycle = True):
+        self.name = name
+        self.down = down
+        self.can_recycle = can_recycle
+        self.nb_reloads = 0
+        self.nb_evaluations = 0
+
+    def __str__(self):
+        return self.name
+
+    async def evaluate(self, closed_roads, seed, nb_steps):
+        await asyncio.sleep(0.01)
+        if self.down:
+            raise ConnectionError(self.name + " is down")
+        self.nb_evaluations += 1
+        return {"max_aqi": float(len(closed_roads))}
+
+    async def recycle(self):
+        if not self.can_recycle:
+            raise ConnectionError(self.name + " is down")
+
+
+class FakeConnection:
+    '''
+    Connection answering the memory expressions with the readings of a Java runtime
+    '''
+    def __init__(self, total_memory, free_memory, max_memory):
+        self.memory = {"total_memory": total_memory, "free_memory": free_memory, "max_memory": max_memory}
+
+    async def expression(self, experiment_id, expression):
+        for name, value in self.memory.items():
+            expression = expression.replace("gama." + name, str(value))
+        return str(eval(expression))
+
+
+def fake_pool(slots):
+    pool = GamaPool([], 10, recycle_after_reloads = None, recycle_slowdown = None, recycle_memory = None, hedging = False)
+    pool.free_slots = asyncio.Queue()
+    for slot in slots:
+        pool.slots.append(slot)
+        pool.free_slots.put_nowait(slot)
+    return pool
+
+
+def test_failed_simulation_runs_again_on_another_slot():
+    async def run():
+        pool = fake_pool([FakeSlot("down", down = True, can_recycle = False), FakeSlot("up")])
+        assert await pool.evaluate_many([[1, 2], [3]]) == [{"max_aqi": 2.0}, {"max_aqi": 1.0}]
+        await asyncio.sleep(0.05)
+        assert [str(slot) for slot in pool.slots] == ["up"]
+    asyncio.run(run())
+
+
+def test_waiting_runs_fail_when_the_last_slot_is_dropped():
+    async def run():
+        pool = fake_pool([FakeSlot("down", down = True, can_recycle = False)])
+        # The runs queued behind the only slot must not wait forever once it is removed
+        results = await asyncio.wait_for(asyncio.gather(*[pool.evaluate([road]) for road in range(4)],
+                                                        return_exceptions = True), 5)
+        assert pool.slots == []
+        assert all(isinstance(result, RuntimeError) for result in results)
+    asyncio.run(run())
+
+
+def hedging_pool():
+    # Any simulation running longer than 0.01 s is hedged
+    pool = fake_pool([FakeSlot("a"), FakeSlot("b")])
+    pool.hedging = True
+    pool.run_times.extend([0.001] * HEDGING_MIN_RUNS)
+    return pool
+
+
+def test_hedged_simulation_keeps_the_run_that_succeeded():
+    async def run():
+        pool = hedging_pool()
+        finish = asyncio.Event()
+        runs = []
+
+        async def fake_run(closed_roads, seed, nb_steps, started):
+            runs.append(closed_roads)
+            index = len(runs)
+            started.set()
+            await finish.wait()
+            if index == 1:
+                raise ConnectionError("lost")
+            return {"max_aqi": 1.0}
+        pool.run = fake_run
+
+        evaluation = asyncio.ensure_future(pool.evaluate([1]))
+        while len(runs) < 2:
+            await asyncio.sleep(0.01)
+        # Both runs finish together, the first one with an error
+        finish.set()
+        assert await evaluation == {"max_aqi": 1.0}
+        assert pool.nb_hedges == 1
+    asyncio.run(run())
+
+
+def test_cancelled_evaluation_cancels_its_run():
+    async def run():
+        pool = hedging_pool()
+        cancelled = []
+
+        async def fake_run(closed_roads, seed, nb_steps, started):
+            # Still waiting for a slot
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled.append(closed_roads)
+                raise
+        pool.run = fake_run
+
+        evaluation = asyncio.ensure_future(pool.evaluate([1]))
+        await asyncio.sleep(0.01)
+        evaluation.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await evaluation
+        await asyncio.sleep(0)
+        assert cancelled == [[1]]
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("total_memory, free_memory, nb_reloads, reason", [
+    # Half of the heap allocated so far is free: the memory in use is far from the maximum
+    (2000, 1000, 50, None),
+    (9000, 400, 50, "86% of the server memory in use"),
+    # Just loaded: it is not the experiment holding the memory
+    (9000, 400, STEP_TIME_WINDOW - 1, None)])
+def test_memory_recycling(total_memory, free_memory, nb_reloads, reason):
+    async def run():
+        pool = GamaPool([], 10, recycle_after_reloads = None, recycle_slowdown = None, recycle_memory = 0.85)
+        slot = GamaSlot(FakeConnection(total_memory, free_memory, 10000), "experiment")
+        slot.nb_reloads = nb_reloads
+        # The memory is only read every MEMORY_CHECK_INTERVAL simulations
+        reasons = [await pool.recycling_reason(slot) for _ in range(MEMORY_CHECK_INTERVAL)]
+        assert reasons == [None] * (MEMORY_CHECK_INTERVAL - 1) + [reason]
+    asyncio.run(run())
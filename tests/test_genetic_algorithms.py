@@ -0,0 +1,31 @@
+import asyncio
+import queue
+
+
+def test_migration_replaces_the_worst_by_the_elites_of_the_previous_island(load_script):
+    ga = load_script("Optimaztion Algorithms/Genetic Algorithms.py")
+    ga.NB_MIGRANTS = 2
+    inboxes = [queue.Queue(), queue.Queue()]
+    # The fitness is the inverse of the max AQI: the higher the better
+    first = [ga.Individual([i], fitness) for i, fitness in enumerate([0.1, 0.5, 0.3, 0.4])]
+    second = [ga.Individual([10 + i], fitness) for i, fitness in enumerate([0.2, 0.01, 0.02])]
+
+    ga.migrate(first, 0, inboxes)
+    assert inboxes[1].qsize() == 2 and inboxes[0].empty()
+    population = ga.migrate(second, 1, inboxes)
+    assert sorted(ind.chromosome for ind in population) == [[1], [3], [10]]
+    # The elites of the second island go to the first one
+    assert [inboxes[0].get_nowait()[0] for _ in range(2)] == [[10], [12]]
+
+
+def test_failed_island_still_reports(load_script):
+    ga = load_script("Optimaztion Algorithms/Genetic Algorithms.py")
+    ga.EVALUATOR = "synthetic"
+
+    async def evolve(population_size, island_index = None, inboxes = None):
+        raise RuntimeError("GAMA error halfway")
+    ga.evolve = evolve
+
+    results = queue.Queue()
+    asyncio.run(ga.run_island(0, ("localhost", 6868, 1), 10, [], results))
+    assert results.get_nowait() is None
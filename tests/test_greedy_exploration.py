@@ -0,0 +1,11 @@
+import asyncio
+
+from evaluator import SyntheticEvaluator
+
+
+def test_stops_when_no_road_can_be_closed(load_script):
+    greedy = load_script("Recursive Algorithms/Greedy Exploration.py")
+    greedy.feasible_adjacent_roads = lambda closed_roads: []
+    root = greedy.Node([1, 2])
+    assert asyncio.run(greedy.greedy_exploration(SyntheticEvaluator(), root, root)) is root
+    assert root.children == []
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from evaluator import Evaluator
+
+
+class RankEvaluator(Evaluator):
+    # The max AQI of a closure set [i] is i: trial i is the i-th best
+    async def evaluate_many(self, closure_sets, seeds = None):
+        await asyncio.sleep(0)
+        return [{"max_aqi": float(closed_roads[0])} for closed_roads in closure_sets]
+
+
+@pytest.fixture
+def sweep_module(load_script):
+    return load_script("Tools/Hyperparameter Sweep.py")
+
+
+async def run_trial(sweep_module, sweep, trial, nb_evaluations = None):
+    # Evaluates one candidate at a time, until stopped or after nb_evaluations
+    try:
+        while nb_evaluations is None or trial.nb_evaluations < nb_evaluations:
+            await trial.evaluate_many([[trial.index]])
+    except sweep_module.TrialStopped:
+        pass
+    sweep.finish(trial)
+
+
+def test_successive_halving(sweep_module):
+    async def run():
+        sweep = sweep_module.Sweep(RankEvaluator(), [{"N": n} for n in range(8)], min_evaluations = 2, eta = 2,
+                                   max_trial_evaluations = 16)
+        assert sweep.rungs == [2, 4, 8]
+        await asyncio.gather(*[run_trial(sweep_module, sweep, trial) for trial in sweep.trials])
+        assert [len(promoted) for promoted in sweep.promoted] == [4, 2, 1]
+        assert [trial.status for trial in sweep.trials] == ["completed", "stopped at 8 evaluations",
+                                                            "stopped at 4 evaluations", "stopped at 4 evaluations"] \
+                                                           + ["stopped at 2 evaluations"] * 4
+        assert [trial.nb_evaluations for trial in sweep.trials] == [16, 8, 4, 4, 2, 2, 2, 2]
+        assert sweep.nb_evaluations == 40
+        assert sweep.best_max_aqi == 0.0
+        assert sweep.trials[0].curve[-1] == (16, 0.0)
+    asyncio.run(run())
+
+
+def test_finished_trials_do_not_hold_back_the_rungs(sweep_module):
+    async def run():
+        sweep = sweep_module.Sweep(RankEvaluator(), [{}] * 4, min_evaluations = 2, eta = 2, max_trial_evaluations = 8)
+        # Trial 3 stops by itself after one evaluation, trial 2 fails
+        async def failing_trial(trial):
+            await trial.evaluate_many([[trial.index]])
+            sweep.finish(trial, RuntimeError("simulation failed"))
+
+        await asyncio.wait_for(asyncio.gather(run_trial(sweep_module, sweep, sweep.trials[0]),
+                                              run_trial(sweep_module, sweep, sweep.trials[1]),
+                                              failing_trial(sweep.trials[2]),
+                                              run_trial(sweep_module, sweep, sweep.trials[3], nb_evaluations = 1)), 5)
+        assert [trial.status for trial in sweep.trials] == ["completed", "stopped at 2 evaluations",
+                                                            "failed: RuntimeError('simulation failed')", "finished"]
+    asyncio.run(run())
+
+
+def test_sweep_settings(sweep_module):
+    sweep_module.SWEEP_MODE = "grid"
+    sweep_module.GRID = {"N": [5, 7], "c1": [1, 2, 3]}
+    settings = sweep_module.sweep_settings()
+    assert len(settings) == 6 and {"N": 7, "c1": 3} in settings
+
+    sweep_module.SWEEP_MODE = "random"
+    sweep_module.RANDOM_SPACE = {"N": (5, 15), "w_end": (0.1, 0.5), "c1": [1, 2]}
+    sweep_module.NB_RANDOM_TRIALS = 20
+    for trial_settings in sweep_module.sweep_settings():
+        assert isinstance(trial_settings["N"], int) and 5 <= trial_settings["N"] <= 15
+        assert 0.1 <= trial_settings["w_end"] <= 0.5
+        assert trial_settings["c1"] in (1, 2)
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from evaluator import QueueEvaluator
+from job_queue import DONE, FAILED, LEASED, MAX_ATTEMPTS, PENDING, JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.sqlite")
+    yield queue
+    queue.close()
+
+
+def job_row(queue, id):
+    return queue.connection.execute("SELECT status, worker, attempts FROM jobs WHERE id = ?", (id,)).fetchone()
+
+
+def test_lease_and_complete(queue):
+    ids = queue.enqueue([[1, 2], [3]], [1.0, 2.0], 10)
+    assert queue.lease("a", 1) == [(ids[0], [1, 2], 1.0, 10)]
+    assert queue.lease("b", 5) == [(ids[1], [3], 2.0, 10)]
+    assert queue.lease("c", 5) == []
+    queue.complete(ids[0], {"max_aqi": 20.0})
+    assert queue.results(ids) == {ids[0]: (DONE, {"max_aqi": 20.0}, None)}
+    assert queue.status() == {DONE: 1, LEASED: 1}
+
+
+def test_expired_lease_is_leased_again(queue):
+    id, = queue.enqueue([[1]], [0.0], 10)
+    queue.lease("a", 1, lease_duration = -1)
+    assert [job[0] for job in queue.lease("b", 1)] == [id]
+    assert job_row(queue, id) == (LEASED, "b", 2)
+    # A heartbeat of the previous worker does not extend the new lease
+    queue.heartbeat("a", [id], lease_duration = -1)
+    assert queue.lease("c", 1) == []
+
+
+def test_job_killing_its_workers_is_given_up(queue):
+    id, = queue.enqueue([[1]], [0.0], 10)
+    for _ in range(MAX_ATTEMPTS):
+        assert len(queue.lease("worker", 1, lease_duration = -1)) == 1
+    assert queue.lease("worker", 1) == []
+    assert job_row(queue, id) == (FAILED, None, MAX_ATTEMPTS)
+    status, metrics, error = queue.results([id])[id]
+    assert status == FAILED and "expired" in error
+
+
+def test_fail_retries_then_gives_up(queue):
+    id, = queue.enqueue([[1]], [0.0], 10)
+    for attempt in range(1, MAX_ATTEMPTS):
+        queue.lease("a", 1)
+        queue.fail("a", id, "error")
+        assert job_row(queue, id) == (PENDING, None, attempt)
+    queue.lease("a", 1)
+    queue.fail("a", id, "error")
+    assert job_row(queue, id)[0] == FAILED
+
+
+def test_fail_only_by_the_lease_holder(queue):
+    id, = queue.enqueue([[1]], [0.0], 10)
+    queue.lease("a", 1, lease_duration = -1)
+    queue.lease("b", 1)
+    queue.fail("a", id, "error")
+    assert job_row(queue, id) == (LEASED, "b", 2)
+
+
+def test_release_does_not_count_the_attempt(queue):
+    id, = queue.enqueue([[1]], [0.0], 10)
+    queue.lease("a", 1)
+    queue.release("a", [id])
+    assert job_row(queue, id) == (PENDING, None, 0)
+
+
+def test_queue_evaluator_deadline(tmp_path):
+    async def run():
+        evaluator = QueueEvaluator(tmp_path / "jobs.sqlite", nb_steps = 10, poll_interval = 0.01, timeout = 0.05)
+        await evaluator.start()
+        # No worker serves the queue
+        with pytest.raises(TimeoutError):
+            await evaluator.evaluate_many([[1]], [0.0])
+        assert evaluator.queue.status() == {FAILED: 1}
+        await evaluator.close()
+    asyncio.run(run())
+
+
+def test_queue_evaluator_failed_job(tmp_path):
+    async def run():
+        evaluator = QueueEvaluator(tmp_path / "jobs.sqlite", nb_steps = 10, poll_interval = 0.01)
+        await evaluator.start()
+        worker = JobQueue(tmp_path / "jobs.sqlite")
+
+        async def serve():
+            while True:
+                for id, closed_roads, seed, nb_steps in worker.lease("worker", 10):
+                    if closed_roads == [1]:
+                        worker.complete(id, {"max_aqi": 1.0})
+                    else:
+                        worker.fail("worker", id, "simulation failed")
+                await asyncio.sleep(0.01)
+
+        server = asyncio.ensure_future(serve())
+        assert await evaluator.evaluate_many([[1]], [0.0]) == [{"max_aqi": 1.0}]
+        with pytest.raises(RuntimeError):
+            await evaluator.evaluate_many([[2]], [0.0])
+        server.cancel()
+        worker.close()
+        await evaluator.close()
+    asyncio.run(run())
@@ -0,0 +1,49 @@
+import asyncio
+
+from evaluator import SyntheticEvaluator
+
+
+def test_dead_ends_are_terminal(load_script):
+    mcts = load_script("Recursive Algorithms/Monte Carlo Tree Search.py")
+    # Only road 3 can be closed from the initial state, then nothing
+    mcts.feasible_adjacent_roads = lambda closed_roads: [(3,)] if 3 not in closed_roads else []
+    mcts.rollout_weights = lambda actions: [1.0] * len(actions)
+
+    async def run():
+        evaluator = SyntheticEvaluator()
+        searcher = mcts.MCTS(evaluator, timeLimit = None, iterationLimit = 5, explorationConstant = 1.0)
+        state = mcts.ClosedRoads(evaluator, [1, 2], 30.0)
+        action = await searcher.search(initialState = state, root_max_aqi = 30.0, needDetails = True)
+        assert action["action"] == (3,)
+        child = searcher.root.children[(3,)]
+        assert child.isTerminal and child.children == {}
+        # Nothing can be closed from the dead end
+        assert await searcher.search(initialState = searcher.advance((3,)), root_max_aqi = 30.0) is None
+    asyncio.run(run())
+
+
+def test_saved_tree_is_only_resumed_with_the_same_settings(load_script, tmp_path):
+    mcts = load_script("Recursive Algorithms/Monte Carlo Tree Search.py")
+    mcts.feasible_adjacent_roads = lambda closed_roads: [(road,) for road in (3, 4, 5) if road not in closed_roads]
+    mcts.rollout_weights = lambda actions: [1.0] * len(actions)
+    file = tmp_path / "tree.json.gz"
+    settings = mcts.tree_settings([2, 1])
+
+    async def run():
+        evaluator = SyntheticEvaluator()
+        searcher = mcts.MCTS(evaluator, timeLimit = None, iterationLimit = 10, explorationConstant = 1.0)
+        state = mcts.ClosedRoads(evaluator, [1, 2], 30.0, seed = 7.0)
+        await searcher.search(initialState = state, root_max_aqi = 30.0)
+        searcher.save(file, settings)
+
+        loaded = mcts.MCTS(evaluator, timeLimit = None, iterationLimit = 10, explorationConstant = 1.0)
+        state = loaded.load(file, mcts.tree_settings([1, 2]))
+        # The seed of the tree is returned with its state, the one of the run is left alone
+        assert state.state == [1, 2] and state.seed == 7.0 and mcts.RUN_SEED != 7.0
+        assert loaded.root.numVisits == searcher.root.numVisits
+        assert loaded.root.children[(3,)].state.seed == 7.0
+
+        mcts.NB_STEPS += 1
+        assert loaded.load(file, mcts.tree_settings([1, 2])) is None
+        assert loaded.load(file, {**settings, "initial_closed_roads": [1]}) is None
+    asyncio.run(run())
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from evaluator import CachedEvaluator, SyntheticEvaluator
+from portfolio import BudgetExhausted, Portfolio, portfolio_best
+from search_space import PHODIBO, PHODIBO_2023, SearchSpace
+
+
+def test_free_slot_goes_to_the_member_with_the_most_weight_per_run():
+    async def run():
+        portfolio = Portfolio(SyntheticEvaluator(), 1)
+        first, light, heavy = portfolio.member("first"), portfolio.member("light"), portfolio.member("heavy")
+        await portfolio.acquire(first)
+        waiting = [asyncio.ensure_future(portfolio.acquire(light)), asyncio.ensure_future(portfolio.acquire(heavy))]
+        await asyncio.sleep(0)
+        light.weight, heavy.weight = 0.1, 1.0
+        portfolio.release(first)
+        await asyncio.sleep(0)
+        assert [future.done() for future in waiting] == [False, True]
+        assert (light.running, heavy.running, portfolio.free_slots) == (0, 1, 0)
+        portfolio.release(heavy)
+        await asyncio.sleep(0)
+        assert waiting[0].done() and light.running == 1
+    asyncio.run(run())
+
+
+def test_budget():
+    async def run():
+        portfolio = Portfolio(SyntheticEvaluator(), 2, budget = 3)
+        member = portfolio.member("member")
+        await member.evaluate_many([[1], [2], [3]])
+        with pytest.raises(BudgetExhausted):
+            await member.evaluate([4])
+        assert portfolio.nb_evaluations == 3
+    asyncio.run(run())
+
+
+def test_cache_hits_use_neither_budget_nor_slots():
+    async def run():
+        evaluator = CachedEvaluator(SyntheticEvaluator())
+        portfolio = Portfolio(evaluator, 1, budget = 2)
+        first, second = portfolio.member("first"), portfolio.member("second")
+        # The same closure set requested by both members at once is simulated once
+        await asyncio.gather(first.evaluate([1]), second.evaluate([1]))
+        await first.evaluate([2])
+        await second.evaluate_many([[1], [2]])
+        assert (portfolio.nb_evaluations, evaluator.nb_hits, portfolio.free_slots) == (2, 3, 1)
+        assert second.nb_evaluations == 3
+        with pytest.raises(BudgetExhausted):
+            await second.evaluate([3])
+    asyncio.run(run())
+
+
+def test_weights_follow_the_improvement_rate():
+    portfolio = Portfolio(SyntheticEvaluator(), 1)
+    fast, slow, new = portfolio.member("fast"), portfolio.member("slow"), portfolio.member("new")
+    for i in range(60):
+        fast.record(100.0 - i)
+        slow.record(100.0 - i / 10)
+    portfolio.rebalance()
+    assert fast.weight > slow.weight > 0
+    # Members still in their first evaluations are not penalised
+    assert new.weight >= fast.weight
+
+
+def test_best_is_shared_across_search_spaces():
+    async def run():
+        counting = CachedEvaluator(SyntheticEvaluator())
+        portfolio = Portfolio(counting, 4, seed = 7.0)
+        pso, ga = portfolio.member("pso"), portfolio.member("ga")
+        pso_space, ga_space = SearchSpace(PHODIBO_2023), SearchSpace(PHODIBO)
+        assert await portfolio_best(ga, ga_space) is None
+
+        # A closure set of the PSO space is not a point of the GA space: it is projected and simulated once
+        best = pso_space.to_closed_roads([False] * pso_space.dimension)
+        await pso.evaluate(best, 7.0)
+        assert portfolio.best_closed_roads == best
+        vector, max_aqi = await portfolio_best(ga, ga_space)
+        projection = ga_space.to_closed_roads(vector)
+        assert set(projection) >= set(PHODIBO) and set(projection) >= set(best)
+        assert max_aqi == (await SyntheticEvaluator().evaluate(projection, 7.0))["max_aqi"]
+        assert ga.nb_evaluations == 1
+        await portfolio_best(ga, ga_space)
+        assert ga.nb_evaluations == 1
+
+        # An exact point of the space is returned with the shared max AQI, without simulation
+        vector, max_aqi = await portfolio_best(pso, pso_space)
+        assert pso_space.to_closed_roads(vector) == portfolio.best_closed_roads and max_aqi == portfolio.best_max_aqi
+        assert pso.nb_evaluations == 1
+    asyncio.run(run())
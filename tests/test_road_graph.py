@@ -0,0 +1,62 @@
+import shapefile
+import pytest
+
+from road_graph import RoadGraph, get_road_graph
+from search_space import PHODIBO, PHODIBO_2023
+
+#   A --0-- B --1-- C
+#           |       |
+#           3       2
+#           |       |
+#           +------ D --4-- E
+# Road 5 (F-G) is a separate component of the original network
+POINTS = {"A": (0, 0), "B": (1, 0), "C": (2, 0), "D": (2, 1), "E": (3, 1), "F": (5, 5), "G": (6, 5)}
+ROADS = [("A", "B", "Main"), ("B", "C", "Main"), ("C", "D", ""), ("B", "D", "Side"), ("D", "E", "Side"), ("F", "G", "Far")]
+
+
+@pytest.fixture
+def road_graph(tmp_path):
+    file = tmp_path / "roads.shp"
+    with shapefile.Writer(str(file), shapeType = shapefile.POLYLINE) as writer:
+        writer.field("name", "C")
+        writer.field("osm_id", "C")
+        for road, (source, target, name) in enumerate(ROADS):
+            writer.line([[POINTS[source], POINTS[target]]])
+            writer.record(name, str(road))
+    return RoadGraph(file, cant_close = [5])
+
+
+def test_adjacent_roads(road_graph):
+    assert sorted(road_graph.adjacent_roads([1])) == [0, 2, 3]
+    assert sorted(road_graph.adjacent_roads([1, 2])) == [0, 3, 4]
+
+
+def test_street_groups(road_graph):
+    # Roads 3 and 4 share a name and a vertex, road 2 has no name and is its own street
+    assert road_graph.street_groups() == [[0, 1], [2], [3, 4], [5]]
+
+
+def test_is_feasible(road_graph):
+    assert road_graph.is_feasible([])
+    # Closing one road of the cycle, or a dead end, keeps the open roads connected
+    assert road_graph.is_feasible([2])
+    assert road_graph.is_feasible([4])
+    # Closing both roads from B to D separates A-B-C from D-E
+    assert not road_graph.is_feasible([2, 3])
+    # Roads that can't be closed
+    assert not road_graph.is_feasible([5])
+
+
+def test_repair(road_graph):
+    assert road_graph.repair([4]) == [4]
+    assert road_graph.repair([2, 5]) == [2]
+    repaired = road_graph.repair([2, 3])
+    assert len(repaired) == 1 and road_graph.is_feasible(repaired)
+    # The fixed roads are never reopened
+    assert road_graph.repair([2, 3], fixed_roads = [2]) == [2]
+
+
+def test_pedestrian_areas_are_feasible():
+    road_graph = get_road_graph()
+    assert road_graph.is_feasible(PHODIBO)
+    assert road_graph.is_feasible(PHODIBO_2023)
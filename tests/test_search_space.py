@@ -0,0 +1,46 @@
+import random
+
+from road_graph import get_road_graph
+from search_space import PHODIBO, PHODIBO_2023, SearchSpace
+
+
+def test_vector_round_trip():
+    space = SearchSpace(fixed_roads = [1, 4], cant_close = [2], nb_roads = 8)
+    assert space.free_roads == [0, 3, 5, 6, 7]
+    assert space.dimension == 5
+    rng = random.Random(0)
+    for _ in range(50):
+        vector = [rng.random() < 0.5 for _ in range(space.dimension)]
+        closed_roads = space.to_closed_roads(vector)
+        assert set(closed_roads) >= {1, 4} and 2 not in closed_roads
+        assert space.to_vector(closed_roads) == vector
+        assert space.to_closed_roads(space.to_vector(closed_roads)) == closed_roads
+
+
+def test_groups():
+    space = SearchSpace(fixed_roads = [1], cant_close = [2], nb_roads = 6, groups = [[0, 1, 2], [3, 4], [5]])
+    # The fixed and forbidden roads are left out of the units, empty units are dropped
+    assert space.units == [(0,), (3, 4), (5,)]
+    assert space.unit_of(4) == (3, 4)
+    assert space.unit_of(1) is None
+    # A unit is closed when all its roads are
+    assert space.to_vector([1, 3]) == [False, False, False]
+    assert space.to_vector([1, 3, 4]) == [False, True, False]
+    assert space.to_closed_roads([True, True, False]) == [0, 1, 3, 4]
+
+
+def test_closure_set_of_another_space():
+    space = SearchSpace(PHODIBO_2023)
+    closed_roads = sorted(set(PHODIBO) | set(PHODIBO_2023))
+    # The roads of PHODIBO outside PHODIBO_2023 are free roads of the space
+    assert space.to_closed_roads(space.to_vector(closed_roads)) == closed_roads
+
+
+def test_repair():
+    space = SearchSpace(PHODIBO)
+    road_graph = get_road_graph()
+    rng = random.Random(1)
+    for _ in range(5):
+        vector = [rng.random() < 0.3 for _ in range(space.dimension)]
+        space.repair(vector)
+        assert road_graph.is_feasible(space.to_closed_roads(vector))
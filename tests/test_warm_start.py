@@ -0,0 +1,54 @@
+from road_graph import get_road_graph
+from search_space import PHODIBO, SearchSpace
+from warm_start import load_prior_results, model_marker, read_pso_results, read_saved_data, top_closure_sets, top_solutions
+
+LOG = """process initial fitness
+NEW_ROADS_SET = [{'type': 'list<int>', 'name': 'Closed roads', 'value': [3, 1, 2]}]
+NEW_ROADS_SET = [{'type': 'list<int>', 'name': 'Closed roads', 'value': [4]}]
+AQI = 25.5
+AQI = 2.4e1
+process initial fitness
+NEW_ROADS_SET = [{'type': 'list<int>', 'name': 'Closed roads', 'value': [5]}]
+process initial fitness
+"""
+
+
+def test_read_pso_results(tmp_path):
+    file = tmp_path / "pso results - N=2.txt"
+    file.write_text(LOG + model_marker(10) + "\nNEW_ROADS_SET = [6] on localhost:6868/1\nAQI = 30.0 CLOSED_ROADS = [7, 6]\n")
+    # The closure sets of a block cut before its AQIs are dropped
+    assert read_pso_results(file) == [((1, 2, 3), 25.5, None), ((4,), 24.0, None), ((6, 7), 30.0, model_marker(10))]
+
+
+def test_read_saved_data(tmp_path):
+    file = tmp_path / "SavedData.txt"
+    file.write_text("nb_closed_roads2: closed roads: [2,1]; cycle: 4; max_aqi: 0.5\n"
+                    "nb_closed_roads2: closed roads: [2,1]; cycle: 8; max_aqi: 0.75\n")
+    assert read_saved_data(file) == [((1, 2), 0.75, None)]
+
+
+def test_only_the_max_aqis_of_the_current_model_are_known(tmp_path):
+    old, new = tmp_path / "pso results - old.txt", tmp_path / "pso results - new.txt"
+    old.write_text("AQI = 50.0 CLOSED_ROADS = [1]\nAQI = 10.0 CLOSED_ROADS = [2]\nAQI = 30.0 CLOSED_ROADS = [3]\n")
+    new.write_text(model_marker(10) + "\nAQI = 40.0 CLOSED_ROADS = [1]\nAQI = 20.0 CLOSED_ROADS = [1]\n")
+    known, ranked = load_prior_results(10, [old, new], saved_data_file = None)
+    assert known == {(1,): 30.0}
+    # The other AQIs only rank the closure sets of their log
+    assert ranked == {(2,): 0.0, (3,): 1 / 3}
+    assert top_closure_sets(3, 10, (known, ranked)) == [((1,), 30.0), ((2,), None), ((3,), None)]
+    # Another simulation length: nothing is known
+    assert load_prior_results(20, [old, new], saved_data_file = None)[0] == {}
+
+
+def test_top_solutions_keep_their_known_max_aqi():
+    space = SearchSpace(PHODIBO)
+    free_road = next(road for road in space.free_roads if get_road_graph().is_feasible(PHODIBO + [road]))
+    known = {tuple(sorted(PHODIBO + [free_road])): 20.0,
+             # Not an exact point of the space: the pedestrian area is not closed
+             (free_road,): 10.0}
+    ranked = {tuple(PHODIBO): 0.0}
+    solutions = top_solutions(5, space, 10, (known, ranked), resimulate = False)
+    assert [(space.to_closed_roads(vector), max_aqi) for vector, max_aqi in solutions] == [(sorted(PHODIBO + [free_road]), 20.0),
+                                                                                          (sorted(PHODIBO), None)]
+    assert [max_aqi for vector, max_aqi in top_solutions(5, space, 10, (known, ranked), resimulate = True)] == [None, None]
+    assert top_solutions(0, space, 10, (known, ranked)) == []